@@ -0,0 +1,81 @@
+"""Synthetic catalogs for the benchmarks."""
+
+import random
+import sys
+from pathlib import Path
+from typing import Iterable
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "src"))
+
+from mediasub.source import LastPullContext  # noqa: E402
+
+from sources import Content, ExtendedSource, Series  # noqa: E402
+
+SYLLABLES = ["ka", "shi", "to", "na", "ru", "mi", "ko", "ya", "no", "ha", "ji", "ken", "ro", "su", "bo", "te", "ri"]
+WORDS = ["the", "of", "hero", "academy", "blade", "dragon", "king", "world", "love", "tower", "god", "slime", "isekai"]
+
+
+class FakeSource(ExtendedSource):
+    url = "https://example.com/"  # type: ignore
+
+    def __init__(self, name: str, series: list[Series]):
+        super().__init__()
+        self.name = name  # type: ignore
+        self.series = series
+
+    async def pull(self, last_pull_ctx: LastPullContext | None = None) -> Iterable[Content]:
+        return []
+
+    async def get_all(self) -> Iterable[Series]:
+        return self.series
+
+
+def random_name(rnd: random.Random) -> str:
+    words = [
+        "".join(rnd.choices(SYLLABLES, k=rnd.randint(1, 4))) if rnd.random() < 0.6 else rnd.choice(WORDS)
+        for _ in range(rnd.randint(1, 5))
+    ]
+    return " ".join(words).title()
+
+
+def make_sources(
+    size: int, *, nb_sources: int = 4, aliases: int = 2, overlap: float = 0.3, seed: int = 0
+) -> list[FakeSource]:
+    """Build `nb_sources` sources sharing `size` series.
+
+    Each series is listed by one source, plus by each other source with a probability of `overlap`, and has up to
+    `aliases` aliases.
+    """
+    rnd = random.Random(seed)
+    listings: list[list[Series]] = [[] for _ in range(nb_sources)]
+
+    for i in range(size):
+        name = random_name(rnd)
+        series_aliases = [random_name(rnd) for _ in range(rnd.randint(0, aliases))]
+        owner = rnd.randrange(nb_sources)
+        for j, listing in enumerate(listings):
+            if j != owner and rnd.random() >= overlap:
+                continue
+            listing.append(
+                Series(
+                    id_name=f"{name.lower().replace(' ', '-')}-{i}",
+                    name=name,
+                    aliases=series_aliases,
+                    genres=rnd.sample(WORDS, k=2),
+                    lang=rnd.choice(("fr", "vf", "vostfr")),
+                    type="anime" if j == 1 else "manga",
+                )
+            )
+
+    return [FakeSource(f"Source {j}", listing) for j, listing in enumerate(listings)]
+
+
+def typing_trace(sources: list[FakeSource], nb_queries: int, *, seed: int = 0) -> list[str]:
+    """Return the successive prefixes a user would type to search `nb_queries` existing series."""
+    rnd = random.Random(seed)
+    all_series = [series for src in sources for series in src.series]
+    queries: list[str] = []
+    for _ in range(nb_queries):
+        name = rnd.choice(all_series).name.lower()
+        queries.extend(name[:i] for i in range(1, min(len(name), 20) + 1))
+    return queries
@@ -0,0 +1,113 @@
+"""Peak memory of concurrent chapter downloads, before and after streaming the pages into spooled buffers.
+
+Before: the pages are read whole in memory, and kept until the end of the download (as `SourceSelect` did).
+After: the pages are streamed within the memory budgets, moved to the chapter cache, and closed once uploaded.
+
+Usage: python benchmarks/download_memory.py [concurrency ...]
+"""
+
+import asyncio
+import gc
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, AsyncIterator, Iterable
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "src"))
+
+from chapter_cache import ChapterCache  # noqa: E402
+from sources import Download, DownloadBytes  # noqa: E402
+from sources.buffers import MemoryBudget  # noqa: E402
+from sources.mangas.scanvfdotnet import PageRaw, ScanVFDotNet  # noqa: E402
+
+PAGES = 40
+PAGE_SIZE = 500_000
+UPLOAD_TIME = 0.02  # per batch of 10 pages
+
+
+class BenchSource(ScanVFDotNet):
+    def __init__(self, pages: dict[str, bytes]):
+        super().__init__()
+        self.client = httpx.AsyncClient(transport=httpx.MockTransport(lambda r: self._serve(r, pages)))
+        self._cache = {f"manga/series-{i}/fr": {"url": "", "manga_name": f"series-{i}"} for i in range(100)}
+
+    @staticmethod
+    def _serve(request: httpx.Request, pages: dict[str, bytes]) -> httpx.Response:
+        page = pages[request.url.path.rsplit("/", 1)[1]]
+
+        async def body() -> AsyncIterator[bytes]:
+            # received by chunks, as from the network
+            for i in range(0, len(page), 64 * 1024):
+                yield page[i : i + 64 * 1024]
+
+        return httpx.Response(200, content=body())
+
+    async def _get_pages_raw(self, chapter_url: str) -> Iterable[PageRaw]:
+        return [{"page_slug": str(i), "page_image": f"{i:02d}.jpg"} for i in range(PAGES)]
+
+
+class LegacySource(BenchSource):
+    async def _download_page(self, page_url: str, budget: MemoryBudget, background: bool = False) -> Any:
+        return io.BytesIO((await self._get(page_url)).content)
+
+
+async def upload(downloads: AsyncIterator[Download], keep: bool) -> None:
+    kept: list[Download] = []
+    batch: list[DownloadBytes] = []
+    async for download in downloads:
+        assert isinstance(download, DownloadBytes)  # nosec: B101
+        batch.append(download)
+        if len(batch) == 10:
+            await asyncio.sleep(UPLOAD_TIME)
+            for page in batch:
+                page.data.read()
+                if not keep:
+                    page.data.close()
+            kept.extend(batch)
+            batch = []
+    if not keep:
+        kept.clear()
+
+
+async def run(concurrency: int, legacy: bool, pages: dict[str, bytes]) -> tuple[int, float]:
+    with tempfile.TemporaryDirectory() as directory:
+        source = (LegacySource if legacy else BenchSource)(pages)
+        cache = ChapterCache(directory)
+        await cache.start()
+
+        gc.collect()
+        tracemalloc.start()
+        start = time.perf_counter()
+        refs = [f"manga/series-{i}/fr/1" for i in range(concurrency)]
+        if legacy:
+            await asyncio.gather(*(upload(source.download(ref), keep=True) for ref in refs))
+        else:
+            await asyncio.gather(*(upload(cache.download(source, ref), keep=False) for ref in refs))
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        await cache.close()
+        await source.client.aclose()
+    return peak, elapsed
+
+
+def bench(concurrency: int) -> None:
+    pages = {f"{i:02d}.jpg": os.urandom(PAGE_SIZE) for i in range(PAGES)}
+    before, before_time = asyncio.run(run(concurrency, True, pages))
+    after, after_time = asyncio.run(run(concurrency, False, pages))
+    print(
+        f"{concurrency:>3} downloads of {PAGES * PAGE_SIZE / 2**20:.0f} MiB | "
+        f"before {before / 2**20:>7.1f} MiB ({before_time:.2f}s) | after {after / 2**20:>7.1f} MiB ({after_time:.2f}s)"
+    )
+
+
+if __name__ == "__main__":
+    for n in map(int, sys.argv[1:] or (1, 4, 16)):
+        bench(n)
@@ -0,0 +1,111 @@
+"""Memory kept by the Searcher between two builds, compared with the previous representations.
+
+- the merged catalog (`Searcher.cache`), compared with the previous representation of SeriesInfos;
+- what is kept of each source to compute its next diff (`Searcher._fingerprints`), compared with the series of its
+  last fetch (`Searcher._contributions` before).
+
+Usage: python benchmarks/memory.py [size ...]
+"""
+
+import asyncio
+import copy
+import gc
+import sys
+import tracemalloc
+from dataclasses import dataclass, field
+from typing import Callable
+
+from catalog import make_sources
+
+from searcher import ContributionT, FingerprintsT, Searcher
+from searcher.models import fingerprint
+
+
+@dataclass(kw_only=True)
+class LegacySeriesInfos:
+    name: str
+    description: str | None = None
+    thumbnail: str | None = None
+    popularity: list[int] = field(default_factory=list)
+    types: dict[str, dict[str, set[str]]] = field(default_factory=dict)
+    genres: set[str] = field(default_factory=set)
+    aliases: set[str] = field(default_factory=set)
+
+
+def legacy_merge(searcher: Searcher) -> dict[str, LegacySeriesInfos]:
+    cache: dict[str, LegacySeriesInfos] = {}
+    for src in searcher.sources:
+        for element in src.series:  # type: ignore
+            series_infos = cache.setdefault(element.id_name, LegacySeriesInfos(name=element.name))
+            if series_infos.description is None:
+                series_infos.description = element.description
+            if series_infos.thumbnail is None:
+                series_infos.thumbnail = element.thumbnail
+            if element.popularity:
+                series_infos.popularity.append(element.popularity)
+            series_infos.genres.update(element.genres)
+            series_infos.types.setdefault(element.type, {}).setdefault(element.lang, set()).add(src.name)
+            series_infos.aliases.update(element.aliases)
+    return cache
+
+
+def group(searcher: Searcher) -> dict[str, ContributionT]:
+    contributions: dict[str, ContributionT] = {}
+    for src in searcher.sources:
+        current = contributions[src.name] = {}
+        for element in src.series:  # type: ignore
+            current.setdefault(element.id_name, []).append(element)
+    return contributions
+
+
+def legacy_contributions(searcher: Searcher) -> dict[str, ContributionT]:
+    # copied, as every fetch creates new series
+    return {
+        name: {key: copy.deepcopy(elements) for key, elements in contribution.items()}
+        for name, contribution in group(searcher).items()
+    }
+
+
+def fingerprints(searcher: Searcher) -> dict[str, FingerprintsT]:
+    return {
+        name: {key: fingerprint(elements) for key, elements in contribution.items()}
+        for name, contribution in group(searcher).items()
+    }
+
+
+def measure(build: Callable[[], object]) -> tuple[object, int]:
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def bench(size: int) -> None:
+    searcher = Searcher(*make_sources(size))
+    asyncio.run(searcher.build_cache())
+    contributions = group(searcher)
+
+    legacy, legacy_size = measure(lambda: legacy_merge(searcher))
+    compact, compact_size = measure(lambda: searcher._merge(contributions))  # pylint: disable=protected-access
+    assert isinstance(compact, dict) and len(compact) == len(legacy) == len(searcher.cache)  # nosec: B101
+
+    print(
+        f"{size:>7} series | before {legacy_size / 2**20:>7.1f} MiB | after {compact_size / 2**20:>7.1f} MiB | "
+        f"{compact_size / legacy_size:.0%} | {compact_size / len(compact):.0f} B/series"
+    )
+
+    _, kept_size = measure(lambda: legacy_contributions(searcher))
+    fps, fingerprints_size = measure(lambda: fingerprints(searcher))
+    assert fps == searcher._fingerprints  # nosec: B101  # pylint: disable=protected-access
+    print(
+        f"{'':>7} per source | before {kept_size / 2**20:>7.1f} MiB | after {fingerprints_size / 2**20:>7.1f} MiB | "
+        f"{fingerprints_size / kept_size:.0%}"
+    )
+
+
+if __name__ == "__main__":
+    for size in map(int, sys.argv[1:] or (10_000, 50_000)):
+        bench(size)
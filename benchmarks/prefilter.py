@@ -0,0 +1,78 @@
+"""Compare the trigram prefilter with a full WRatio scan of the index.
+
+Recall is the share of the full scan results matched by a result at least as good (same WRatio score or better, as
+there are a lot of ties) at the same rank with the prefilter, over prefix-typing queries of existing series.
+
+Usage: python benchmarks/prefilter.py [size ...]
+"""
+
+import asyncio
+import statistics
+import sys
+import time
+
+from catalog import make_sources, typing_trace
+from rapidfuzz import fuzz, utils
+
+from searcher import CacheT, Searcher
+from searcher.index import IndexSegment, SearchIndex
+
+
+def run(index: SearchIndex, queries: list[str]) -> tuple[list[list[str]], list[float]]:
+    results: list[list[str]] = []
+    timings: list[float] = []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(index.search(query))
+        timings.append(time.perf_counter() - start)
+    return results, timings
+
+
+def scores(cache: CacheT, query: str, keys: list[str]) -> list[float]:
+    processed_query = utils.default_process(query)
+    return [
+        max(
+            fuzz.WRatio(processed_query, utils.default_process(name)) for name in (cache[key].name, *cache[key].aliases)
+        )
+        for key in keys
+    ]
+
+
+def bench(size: int) -> None:
+    sources = make_sources(size)
+    searcher = Searcher(*sources)
+    asyncio.run(searcher.build_cache())
+    queries = typing_trace(sources, 30)
+
+    prefiltered, prefiltered_timings = run(searcher.index, queries)
+
+    min_choices = IndexSegment.prefilter_min_choices
+    IndexSegment.prefilter_min_choices = sys.maxsize
+    try:
+        full_index = SearchIndex.build((key, (infos.name, *infos.aliases)) for key, infos in searcher.cache.items())
+    finally:
+        IndexSegment.prefilter_min_choices = min_choices
+    full, full_timings = run(full_index, queries)
+
+    matched = total = top1 = 0
+    for query, a, b in zip(queries, prefiltered, full):
+        a_scores, b_scores = scores(searcher.cache, query, a), scores(searcher.cache, query, b)
+        matched += sum(sa >= sb for sa, sb in zip(a_scores, b_scores))
+        total += len(b_scores)
+        top1 += a_scores[:1] >= b_scores[:1]
+    recall = matched / total
+    top1 /= len(queries)
+
+    def fmt(timings: list[float]) -> str:
+        quantiles = statistics.quantiles(timings, n=100)
+        return f"p50 {quantiles[49] * 1000:>6.2f} ms, p99 {quantiles[98] * 1000:>6.2f} ms"
+
+    print(
+        f"{size:>7} series, {len(queries)} queries | full scan: {fmt(full_timings)} | "
+        f"prefilter: {fmt(prefiltered_timings)} | recall {recall:.1%}, same best result {top1:.1%}"
+    )
+
+
+if __name__ == "__main__":
+    for size in map(int, sys.argv[1:] or (10_000, 50_000)):
+        bench(size)
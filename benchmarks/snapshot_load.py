@@ -0,0 +1,41 @@
+"""Compare booting from a catalog snapshot with building the catalog from the sources.
+
+Usage: python benchmarks/snapshot_load.py [size ...]
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from catalog import make_sources
+
+from searcher import Searcher
+
+
+async def bench(size: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "catalog.snapshot")
+        sources = make_sources(size)
+
+        builder = Searcher(*sources, snapshot_path=path)
+        start = time.perf_counter()
+        await builder.build_cache()
+        build_time = time.perf_counter() - start
+
+        loader = Searcher(*sources, snapshot_path=path)
+        start = time.perf_counter()
+        assert loader.load_snapshot()  # nosec: B101
+        load_time = time.perf_counter() - start
+        assert loader.cache == builder.cache  # nosec: B101
+
+        print(
+            f"{size:>7} series | snapshot {os.path.getsize(path) / 1024:>8.0f} KiB | "
+            f"build (without network) {build_time * 1000:>7.0f} ms | load {load_time * 1000:>7.0f} ms"
+        )
+
+
+if __name__ == "__main__":
+    for size in map(int, sys.argv[1:] or (1_000, 10_000, 50_000)):
+        asyncio.run(bench(size))
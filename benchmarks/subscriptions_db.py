@@ -0,0 +1,95 @@
+"""Cost of the subscription lookups before and after the database patches.
+
+Usage: python benchmarks/subscriptions_db.py [rows ...]
+"""
+
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import aiosqlite
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "src"))
+
+from database_patchs import apply_patchs  # noqa: E402
+
+LOOKUPS = {
+    "content subscribers": "SELECT user_id FROM subscription WHERE type = ? AND series = ? AND language = ?",
+    "user subscriptions": "SELECT series, language, type FROM subscription WHERE user_id = ?",
+}
+
+
+async def create_db(path: str, rows: int, rnd: random.Random) -> aiosqlite.Connection:
+    db = await aiosqlite.connect(path)
+    await db.execute(
+        """
+        CREATE TABLE subscription (
+            user_id INTEGER,
+            type TEXT,
+            series TEXT,
+            language TEXT,
+            PRIMARY KEY (user_id, series, language, type)
+        )
+        """
+    )
+    await db.execute("CREATE TABLE database_patchs (version INTEGER)")
+    await db.executemany(
+        "INSERT OR IGNORE INTO subscription VALUES (?, ?, ?, ?)",
+        (
+            (rnd.randrange(rows // 10), rnd.choice(("manga", "anime")), f"series-{rnd.randrange(rows // 5)}", "fr")
+            for _ in range(rows)
+        ),
+    )
+    await db.commit()
+    return db
+
+
+async def measure(db: aiosqlite.Connection, params: dict[str, list[tuple[object, ...]]]) -> dict[str, float]:
+    timings: dict[str, float] = {}
+    for name, sql in LOOKUPS.items():
+        start = time.perf_counter()
+        for args in params[name]:
+            async with db.execute(sql, args) as cursor:
+                await cursor.fetchall()
+        timings[name] = (time.perf_counter() - start) / len(params[name])
+    return timings
+
+
+async def plans(db: aiosqlite.Connection) -> dict[str, str]:
+    result: dict[str, str] = {}
+    for name, sql in LOOKUPS.items():
+        async with db.execute(f"EXPLAIN QUERY PLAN {sql}", (0,) * sql.count("?")) as cursor:
+            result[name] = " / ".join(row[-1] for row in await cursor.fetchall())
+    return result
+
+
+async def bench(rows: int) -> None:
+    rnd = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        db = await create_db(os.path.join(tmp, "db.sqlite"), rows, rnd)
+        params: dict[str, list[tuple[object, ...]]] = {
+            "content subscribers": [
+                (rnd.choice(("manga", "anime")), f"series-{rnd.randrange(rows // 5)}", "fr") for _ in range(200)
+            ],
+            "user subscriptions": [(rnd.randrange(rows // 10),) for _ in range(200)],
+        }
+
+        before, before_plans = await measure(db, params), await plans(db)
+        await apply_patchs(db)
+        after, after_plans = await measure(db, params), await plans(db)
+        await db.close()
+
+    for name in LOOKUPS:
+        print(
+            f"{rows:>8} rows | {name:<20} | before {before[name] * 1000:>7.3f} ms ({before_plans[name]}) | "
+            f"after {after[name] * 1000:>7.3f} ms ({after_plans[name]})"
+        )
+
+
+if __name__ == "__main__":
+    for rows in map(int, sys.argv[1:] or (100_000, 500_000)):
+        asyncio.run(bench(rows))
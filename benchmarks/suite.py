@@ -0,0 +1,142 @@
+"""Benchmark `Searcher.build_cache` and `Searcher.search` on synthetic catalogs.
+
+For each size, it reports the build time, the peak memory allocated by the build (traced separately, as tracing slows
+the build down), and the p50/p99 latency of `Searcher.search` (with its results cache, as the bot runs it) and of a
+bare index search, over prefix-typing query traces.
+
+The results are written as JSON, and can be compared with the results of another commit:
+
+    python benchmarks/suite.py --output before.json
+    git checkout other-branch
+    python benchmarks/suite.py --compare before.json
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import statistics
+import subprocess  # nosec: B404
+import sys
+import time
+import tracemalloc
+from typing import Any, Awaitable, Callable
+
+from catalog import FakeSource, make_sources, typing_trace
+
+from searcher import Searcher
+
+# metrics where lower is better, compared by --compare
+METRICS = ("build_s", "build_peak_mib", "search_p50_ms", "search_p99_ms", "index_p50_ms", "index_p99_ms")
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(  # nosec: B603, B607
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def quantiles_ms(timings: list[float]) -> tuple[float, float]:
+    quantiles = statistics.quantiles(timings, n=100)
+    return round(quantiles[49] * 1000, 3), round(quantiles[98] * 1000, 3)
+
+
+async def timed(func: Callable[[], Awaitable[Any]]) -> float:
+    start = time.perf_counter()
+    await func()
+    return time.perf_counter() - start
+
+
+async def bench(sources: list[FakeSource], queries: list[str]) -> dict[str, Any]:
+    searcher = Searcher(*sources)
+    build_time = await timed(searcher.build_cache)
+
+    tracemalloc.start()
+    await Searcher(*sources).build_cache()
+    build_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    search_timings = [await timed(lambda: searcher.search(query)) for query in queries]
+
+    index_timings: list[float] = []
+    for query in queries:
+        start = time.perf_counter()
+        searcher.index.search(query)
+        index_timings.append(time.perf_counter() - start)
+
+    search_p50, search_p99 = quantiles_ms(search_timings)
+    index_p50, index_p99 = quantiles_ms(index_timings)
+    return {
+        "series": len(searcher.cache),
+        "listings": sum(len(src.series) for src in sources),
+        "queries": len(queries),
+        "build_s": round(build_time, 3),
+        "build_peak_mib": round(build_peak / 2**20, 1),
+        "search_p50_ms": search_p50,
+        "search_p99_ms": search_p99,
+        "index_p50_ms": index_p50,
+        "index_p99_ms": index_p99,
+    }
+
+
+def compare(results: dict[str, Any], baseline: dict[str, Any]) -> None:
+    previous = {run["size"]: run for run in baseline["runs"]}
+    print(f"compared with {baseline.get('revision') or 'baseline'} (ratio > 1 is slower / bigger)", file=sys.stderr)
+    for run in results["runs"]:
+        if (before := previous.get(run["size"])) is None:
+            continue
+        ratios = ", ".join(f"{metric} {run[metric] / before[metric]:.2f}x" for metric in METRICS if before.get(metric))
+        print(f"{run['size']:>7} series | {ratios}", file=sys.stderr)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 50_000, 200_000])
+    parser.add_argument("--sources", type=int, default=4, help="number of fake sources")
+    parser.add_argument("--aliases", type=int, default=2, help="maximum number of aliases per series")
+    parser.add_argument("--overlap", type=float, default=0.3, help="probability a series is listed by another source")
+    parser.add_argument("--queries", type=int, default=30, help="number of series typed in the query trace")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    parser.add_argument("--compare", help="JSON results to compare with")
+    args = parser.parse_args()
+
+    results: dict[str, Any] = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "params": {
+            "sources": args.sources,
+            "aliases": args.aliases,
+            "overlap": args.overlap,
+            "queries": args.queries,
+            "seed": args.seed,
+        },
+        "runs": [],
+    }
+    for size in args.sizes:
+        sources = make_sources(
+            size, nb_sources=args.sources, aliases=args.aliases, overlap=args.overlap, seed=args.seed
+        )
+        queries = typing_trace(sources, args.queries, seed=args.seed)
+        run = {"size": size, **asyncio.run(bench(sources, queries))}
+        results["runs"].append(run)
+        print(json.dumps(run), file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import asyncio
+import io
+import shutil
+import tempfile
+import time
+import zipfile
+from dataclasses import dataclass
+from typing import IO
+
+from sources import DownloadBytes
+
+# the size of the headers of an entry (local and central directory), and of the end of the central directory
+_ENTRY_OVERHEAD = 30 + 46
+_END_OVERHEAD = 22
+
+
+@dataclass
+class Volume:
+    filename: str
+    file: IO[bytes]  # to be closed by the caller
+    size: int
+
+
+class CbzWriter:
+    """Write the pages of a chapter into CBZ archives (ZIP) as they are downloaded, split in volumes of `max_size`
+    bytes.
+
+    The images are already compressed, so they are stored as is. A volume is kept in memory up to `spool_threshold`
+    bytes, then written to a temporary file, so the memory used doesn't depend on the size of the chapter.
+    The pages too big to fit in a volume on their own can't be sent, they are skipped and listed in `skipped`.
+    """
+
+    def __init__(self, name: str, max_size: int, spool_threshold: int = 4 * 1024**2):
+        self.name = name
+        self.max_size = max_size
+        self.spool_threshold = spool_threshold
+
+        self.skipped: list[str] = []
+
+        self._pages = 0
+        self._volumes = 0
+        self._file: IO[bytes] | None = None
+        self._zip: zipfile.ZipFile | None = None
+        # the size the central directory of the current volume will take
+        self._directory_size = 0
+
+    async def add(self, page: DownloadBytes) -> Volume | None:
+        """Add a page (and close it), and return the previous volume if the page didn't fit in it."""
+        with page.data:
+            return await self._add(page.data, page.filename)
+
+    async def _add(self, data: IO[bytes], filename: str) -> Volume | None:
+        # numbered, so the readers keep the pages in order
+        arcname = f"{self._pages:03d}-{filename}"
+        size = data.seek(0, io.SEEK_END)
+        data.seek(0)
+        entry_size = size + _ENTRY_OVERHEAD + 2 * len(arcname.encode())
+        if entry_size + _END_OVERHEAD > self.max_size:
+            self.skipped.append(filename)
+            return None
+        self._pages += 1
+
+        full = None
+        if self._zip is not None and self._projected_size() + entry_size > self.max_size:
+            full = await self._finish_volume(f"{self.name} ({self._volumes + 1}).cbz")
+        if self._zip is None:
+            self._file = tempfile.SpooledTemporaryFile(max_size=self.spool_threshold)
+            self._zip = zipfile.ZipFile(self._file, "w", compression=zipfile.ZIP_STORED)
+            self._directory_size = 0
+
+        await asyncio.to_thread(self._write, zipfile.ZipInfo(arcname, time.localtime()[:6]), data)
+        self._directory_size += 46 + len(arcname.encode())
+        return full
+
+    async def finish(self) -> Volume | None:
+        """Return the last volume, if any page has been added since the previous one."""
+        if self._zip is None:
+            return None
+        # a chapter in a single volume is not numbered
+        filename = f"{self.name}.cbz" if not self._volumes else f"{self.name} ({self._volumes + 1}).cbz"
+        return await self._finish_volume(filename)
+
+    def close(self) -> None:
+        """Release the volume in progress, e.g. if the download failed."""
+        if self._zip is not None:
+            self._zip.close()
+            self._zip = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write(self, info: zipfile.ZipInfo, data: IO[bytes]) -> None:
+        assert self._zip is not None  # nosec: B101
+        # stored as is (the default compression of a ZipInfo)
+        with self._zip.open(info, "w") as entry:
+            shutil.copyfileobj(data, entry)
+
+    def _projected_size(self) -> int:
+        assert self._file is not None  # nosec: B101
+        return self._file.tell() + self._directory_size + _END_OVERHEAD
+
+    async def _finish_volume(self, filename: str) -> Volume:
+        assert self._zip is not None and self._file is not None  # nosec: B101
+        await asyncio.to_thread(self._zip.close)
+        file, self._file, self._zip = self._file, None, None
+        size = file.tell()
+        file.seek(0)
+        self._volumes += 1
+        return Volume(filename, file, size)
@@ -0,0 +1,64 @@
+import asyncio
+import contextlib
+import logging
+from typing import Any, AsyncGenerator
+
+import discord
+
+from utils import BraceMessage as __
+
+logger = logging.getLogger(__name__)
+
+
+class AutocompleteTracker:
+    """Only compute the last autocomplete of a user for a command, and only while it can still be answered.
+
+    Discord sends an autocomplete interaction for every keystroke. Each one waits `debounce` seconds before doing any
+    work, and is cancelled if a newer one comes from the same user for the same command in the meantime (or while it
+    is computed). It is also cancelled once its answer would arrive too late to be used.
+
+    A cancelled autocomplete is not answered: discord.py doesn't respond (nor log) when the handler task is cancelled.
+    """
+
+    # Discord drops the autocomplete responses that come more than 3s after the interaction
+    deadline = 2.5
+
+    def __init__(self, debounce: float = 0.1, log_every: int = 1000):
+        self.debounce = debounce
+        self.log_every = log_every
+        self._inflight: dict[tuple[int, str], asyncio.Task[Any]] = {}
+
+        self._requests = 0
+        self.served = 0
+        self.cancelled = 0
+        self.expired = 0
+
+    @contextlib.asynccontextmanager
+    async def track(self, inter: discord.Interaction) -> AsyncGenerator[None, None]:
+        task = asyncio.current_task()
+        assert task is not None  # nosec: B101
+        key = (inter.user.id, inter.command.qualified_name if inter.command else "")
+
+        if (previous := self._inflight.get(key)) is not None and not previous.done():
+            previous.cancel()
+            self.cancelled += 1
+        self._inflight[key] = task
+
+        remaining = self.deadline - (discord.utils.utcnow() - inter.created_at).total_seconds()
+        try:
+            async with asyncio.timeout(remaining):
+                await asyncio.sleep(self.debounce)
+                yield
+            self.served += 1
+        except TimeoutError:
+            self.expired += 1
+            raise asyncio.CancelledError() from None
+        finally:
+            if self._inflight.get(key) is task:
+                del self._inflight[key]
+
+            self._requests += 1
+            if self._requests % self.log_every == 0:
+                logger.info(
+                    __("Autocomplete: {} served, {} cancelled, {} expired", self.served, self.cancelled, self.expired)
+                )
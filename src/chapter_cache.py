@@ -0,0 +1,392 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import IO, AsyncGenerator, Coroutine
+
+from sources import Download, DownloadBytes, DownloadInProgress, DownloadUrl, ExtendedSource
+from transcode import Transcoder
+from utils import BraceMessage as __
+
+logger = logging.getLogger(__name__)
+
+type Page = tuple[str, str, int]  # (filename, digest, size)
+
+
+@dataclass
+class _Fetch:
+    """A download in progress, followed by all the requests of the chapter."""
+
+    items: list[Page | DownloadInProgress | DownloadUrl] = field(default_factory=list)
+    done: bool = False
+    error: Exception | None = None
+    condition: asyncio.Condition = field(default_factory=asyncio.Condition)
+    followers: int = 0
+    # the pages to delete once nobody follows the download anymore, if it is not stored
+    dropped: list[Page] | None = None
+
+
+class ChapterCache:
+    """Keep the downloaded chapters on disk, so a chapter requested by many users is only downloaded once.
+
+    The pages are stored by the hash of their content (a page in several chapters is stored once), and the chapters by
+    their source and ref, in a manifest listing their pages. Once the pages take more than `max_bytes`, the least
+    recently requested chapters are evicted. The requests of a chapter being downloaded follow that download instead
+    of starting another one.
+
+    Only the downloads made of pages (`DownloadBytes`) are stored, the others (e.g. a link to a video) are only shared.
+    The pages are written to the disk as soon as they are downloaded, and the requests read them from there, so the
+    memory used doesn't depend on the size of the chapter nor on the number of requests.
+
+    The pages of the sources with a `transcode_quality` bigger than `max_page_size` bytes are re-encoded by `transcoder`
+    before being stored, so they are only transcoded once.
+
+    The new releases can be prefetched in the background by `prefetch_workers` tasks, as background downloads: the
+    sources serve the downloads requested by the users first.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = 2 * 1024**3,
+        prefetch_workers: int = 2,
+        prefetch_maxsize: int = 100,
+        transcoder: Transcoder | None = None,
+        max_page_size: int = 1024**2,
+        log_every: int = 100,
+    ):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.transcoder = transcoder
+        self.max_page_size = max_page_size
+        self.prefetch_workers = prefetch_workers
+        self.log_every = log_every
+
+        # key -> its pages, from the least to the most recently requested
+        self._chapters: OrderedDict[str, list[Page]] = OrderedDict()
+        # digest -> the number of chapters that have the page
+        self._references: Counter[str] = Counter()
+        # the chapters being read from the disk, not to be evicted meanwhile
+        self._readers: Counter[str] = Counter()
+        self._fetches: dict[str, _Fetch] = {}
+        self._tasks: set[asyncio.Task[None]] = set()
+        self._prefetch_queue: asyncio.Queue[tuple[ExtendedSource, str]] = asyncio.Queue(prefetch_maxsize)
+        self._prefetch_tasks: list[asyncio.Task[None]] = []
+        # the changes to the files
+        self._lock = asyncio.Lock()
+
+        self.size = 0
+        self.requests = 0
+        self.hits = 0
+        self.shared = 0
+        self.bytes_saved = 0
+        self.prefetched = 0
+
+    async def start(self) -> None:
+        """Load the chapters stored by the last runs."""
+        for key, pages in await asyncio.to_thread(self._load):
+            self._chapters[key] = pages
+            self._reference(pages)
+        logger.info(__("Loaded {} cached chapters ({} MiB)", len(self._chapters), self.size // 1024**2))
+        async with self._lock:
+            await self._evict()
+        self._prefetch_tasks = [asyncio.create_task(self._prefetch_work()) for _ in range(self.prefetch_workers)]
+
+    async def close(self) -> None:
+        """Cancel the downloads in progress."""
+        for task in [*self._prefetch_tasks, *self._tasks]:
+            task.cancel()
+        await asyncio.gather(*self._prefetch_tasks, *self._tasks, return_exceptions=True)
+        self._prefetch_tasks = []
+
+    def metrics(self) -> dict[str, float]:
+        return {
+            "chapters": len(self._chapters),
+            "size": self.size,
+            "requests": self.requests,
+            "hit_ratio": (self.hits + self.shared) / self.requests if self.requests else 0,
+            "bytes_saved": self.bytes_saved,
+            "prefetched": self.prefetched,
+        }
+
+    def prefetch(self, source: ExtendedSource, ref: str) -> bool:
+        """Queue the download of `ref` in the background, without waiting. Return False if it is skipped."""
+        # a download that can't be stored (e.g. a video converted on demand) would be wasted
+        if not (source.supports_download and source.prefetchable) or f"{source.name}/{ref}" in self._chapters:
+            return False
+        try:
+            self._prefetch_queue.put_nowait((source, ref))
+        except asyncio.QueueFull:
+            logger.warning(__("Prefetch queue full, skipping {}", ref))
+            return False
+        return True
+
+    async def download(self, source: ExtendedSource, ref: str) -> AsyncGenerator[Download, None]:
+        """Same as `source.download(ref)`, from the cache if possible."""
+        key = f"{source.name}/{ref}"
+        self.requests += 1
+        if self.requests % self.log_every == 0:
+            logger.info(__("Chapter cache: {}", self.metrics()))
+
+        if key in self._chapters:
+            self.hits += 1
+            async for download in self._read(key):
+                yield download
+            return
+
+        if (fetch := self._fetches.get(key)) is None:
+            fetch = self._fetches[key] = _Fetch()
+            self._spawn(self._fetch(key, source, ref, fetch))
+            shared = False
+        else:
+            self.shared += 1
+            shared = True
+
+        async for download in self._follow(fetch, shared):
+            yield download
+
+    async def _prefetch_work(self) -> None:
+        while True:
+            source, ref = await self._prefetch_queue.get()
+            key = f"{source.name}/{ref}"
+            # already requested by a user meanwhile
+            if key in self._chapters or key in self._fetches:
+                continue
+
+            fetch = self._fetches[key] = _Fetch()
+            try:
+                await self._fetch(key, source, ref, fetch, background=True)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception(__("Unexpected error while prefetching {}", ref))
+                continue
+            if fetch.error is None:
+                self.prefetched += 1
+                logger.debug(__("Prefetched {} from {}", ref, source.name))
+            else:
+                logger.warning(__("Failed to prefetch {} from {}", ref, source.name), exc_info=fetch.error)
+
+    async def _read(self, key: str) -> AsyncGenerator[DownloadBytes, None]:
+        self._chapters.move_to_end(key)
+        self._readers[key] += 1
+        try:
+            pages = self._chapters[key]
+            # the modification time of the manifest keeps the order of the chapters across the runs
+            await asyncio.to_thread(os.utime, self._manifest_path(key))
+            for filename, digest, size in pages:
+                file = self._page_path(digest).open("rb")  # pylint: disable=consider-using-with
+                self.bytes_saved += size
+                yield DownloadBytes(file, filename)
+        except OSError:
+            logger.exception(__("Can't read the cached chapter {}, forgetting it", key))
+            if key in self._chapters:
+                self._unregister(key)
+            raise
+        finally:
+            self._readers[key] -= 1
+            if not self._readers[key]:
+                del self._readers[key]
+
+    async def _follow(self, fetch: _Fetch, shared: bool) -> AsyncGenerator[Download, None]:
+        fetch.followers += 1
+        try:
+            i = 0
+            while True:
+                async with fetch.condition:
+                    await fetch.condition.wait_for(lambda: i < len(fetch.items) or fetch.done)
+                if i == len(fetch.items):
+                    break
+                item = fetch.items[i]
+                i += 1
+                match item:
+                    case (filename, digest, size):
+                        file = self._page_path(digest).open("rb")  # pylint: disable=consider-using-with
+                        if shared:
+                            self.bytes_saved += size
+                        yield DownloadBytes(file, filename)
+                    case DownloadInProgress() if i < len(fetch.items):
+                        continue  # outdated
+                    case _:
+                        yield item
+        finally:
+            fetch.followers -= 1
+            self._drop(fetch)
+
+        if fetch.error is not None:
+            raise fetch.error
+
+    async def _fetch(self, key: str, source: ExtendedSource, ref: str, fetch: _Fetch, background: bool = False) -> None:
+        """Download the chapter for all its requests, independently of them, then store it."""
+        downloads = source.download(ref, background)
+        if self.transcoder is not None and source.transcode_quality is not None:
+            downloads = self.transcoder.transcode(downloads, key, self.max_page_size, source.transcode_quality)
+        try:
+            async for download in downloads:
+                if isinstance(download, DownloadBytes):
+                    item = await self._add_page(download)
+                else:
+                    item = download
+                async with fetch.condition:
+                    fetch.items.append(item)
+                    fetch.condition.notify_all()
+        except Exception as e:  # pylint: disable=broad-except
+            # raised to the requests
+            fetch.error = e
+        finally:
+            async with fetch.condition:
+                fetch.done = True
+                fetch.condition.notify_all()
+
+        pages: list[Page] = [item for item in fetch.items if isinstance(item, tuple)]
+        try:
+            if (
+                fetch.error is None
+                and pages
+                and len(pages) == len(fetch.items)
+                and sum(size for *_, size in pages) <= self.max_bytes
+            ):
+                async with self._lock:
+                    await asyncio.to_thread(self._write_manifest, key, pages)
+                    self._chapters[key] = pages
+                    await self._evict()
+                pages = []
+        except OSError:
+            logger.exception(__("Can't store the chapter {}", key))
+        finally:
+            # kept until then, so the chapter is never requested from the source again while being stored
+            del self._fetches[key]
+            if pages:
+                fetch.dropped = pages
+                self._drop(fetch)
+
+    async def _add_page(self, download: DownloadBytes) -> Page:
+        """Move a downloaded page to the disk, and reference it until its chapter is stored or dropped."""
+        try:
+            tmp, digest, size = await asyncio.to_thread(self._write_page, download.data)
+        finally:
+            download.data.close()
+        page = (download.filename, digest, size)
+        async with self._lock:
+            await asyncio.to_thread(self._commit_page, tmp, digest)
+            self._reference([page])
+        return page
+
+    def _drop(self, fetch: _Fetch) -> None:
+        """Delete the pages of a download that won't be stored, once nobody reads them anymore."""
+        if fetch.dropped is None or fetch.followers:
+            return
+        pages, fetch.dropped = fetch.dropped, None
+
+        async def delete() -> None:
+            async with self._lock:
+                await asyncio.to_thread(self._delete, [], self._dereference(pages))
+
+        self._spawn(delete())
+
+    def _spawn(self, coroutine: Coroutine[None, None, None]) -> None:
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _evict(self) -> None:
+        orphans: list[str] = []
+        evicted: list[str] = []
+        for key in list(self._chapters):
+            if self.size <= self.max_bytes:
+                break
+            if key in self._readers:
+                continue
+            orphans.extend(self._unregister(key))
+            evicted.append(key)
+
+        if evicted:
+            logger.debug(__("Evicting {} chapters from the cache", len(evicted)))
+            await asyncio.to_thread(self._delete, evicted, orphans)
+
+    def _reference(self, pages: list[Page]) -> None:
+        for _, digest, size in pages:
+            if not self._references[digest]:
+                self.size += size
+            self._references[digest] += 1
+
+    def _dereference(self, pages: list[Page]) -> list[str]:
+        """Return the pages that are not referenced anymore."""
+        orphans: list[str] = []
+        for _, digest, size in pages:
+            self._references[digest] -= 1
+            if not self._references[digest]:
+                del self._references[digest]
+                self.size -= size
+                orphans.append(digest)
+        return orphans
+
+    def _unregister(self, key: str) -> list[str]:
+        """Forget a chapter, and return the pages that are not in any chapter anymore."""
+        return self._dereference(self._chapters.pop(key))
+
+    def _manifest_path(self, key: str) -> Path:
+        return self.directory / "chapters" / f"{hashlib.sha256(key.encode()).hexdigest()}.json"
+
+    def _page_path(self, digest: str) -> Path:
+        return self.directory / "pages" / digest[:2] / digest
+
+    def _load(self) -> list[tuple[str, list[Page]]]:
+        """Read the manifests from the least to the most recently requested, and delete the unused pages."""
+        (self.directory / "chapters").mkdir(parents=True, exist_ok=True)
+        (self.directory / "pages").mkdir(parents=True, exist_ok=True)
+
+        manifests: list[tuple[float, str, list[Page]]] = []
+        for path in (self.directory / "chapters").iterdir():
+            if path.suffix != ".json":
+                path.unlink()  # an interrupted write
+                continue
+            try:
+                manifest = json.loads(path.read_text())
+                manifests.append((path.stat().st_mtime, manifest["key"], [tuple(page) for page in manifest["pages"]]))
+            except (OSError, ValueError, KeyError):
+                logger.warning(__("Invalid cache manifest {}, deleting it", path))
+                path.unlink(missing_ok=True)
+        manifests.sort(key=lambda m: m[0])
+
+        used = {digest for *_, pages in manifests for _, digest, _ in pages}
+        for path in (self.directory / "pages").glob("**/*"):
+            if path.is_file() and path.name not in used:
+                path.unlink()
+        return [(key, pages) for _, key, pages in manifests]
+
+    def _write_page(self, data: IO[bytes]) -> tuple[Path, str, int]:
+        """Copy a page to a temporary file, and return it with the hash and the size of the page."""
+        digest = hashlib.sha256()
+        size = 0
+        with tempfile.NamedTemporaryFile(dir=self.directory / "pages", suffix=".tmp", delete=False) as file:
+            while chunk := data.read(1024**2):
+                digest.update(chunk)
+                file.write(chunk)
+                size += len(chunk)
+        return Path(file.name), digest.hexdigest(), size
+
+    def _commit_page(self, tmp: Path, digest: str) -> None:
+        # renamed once complete, so a page is never read half-written
+        path = self._page_path(digest)
+        if path.exists():
+            tmp.unlink()
+        else:
+            path.parent.mkdir(exist_ok=True)
+            os.replace(tmp, path)
+
+    def _write_manifest(self, key: str, pages: list[Page]) -> None:
+        # written after the pages, so a chapter is never stored without its pages
+        tmp = self._manifest_path(key).with_suffix(".tmp")
+        tmp.write_text(json.dumps({"key": key, "pages": pages}))
+        os.replace(tmp, self._manifest_path(key))
+
+    def _delete(self, keys: list[str], digests: list[str]) -> None:
+        # the manifests first, so a chapter is never stored without its pages
+        for key in keys:
+            self._manifest_path(key).unlink(missing_ok=True)
+        for digest in digests:
+            self._page_path(digest).unlink(missing_ok=True)
@@ -0,0 +1,65 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+from sources import Content, ExtendedSource
+from utils import BraceMessage as __
+
+logger = logging.getLogger(__name__)
+
+type GroupCallback = Callable[[ExtendedSource, list[Content]], Awaitable[None]]
+
+
+class Coalescer:
+    """Group the contents of a same series (same `sub_id`) from a same source, received within `window` seconds.
+
+    A source that bulk-uploads many chapters of a series then produces one notification instead of one per chapter.
+    A group is flushed `window` seconds after its first content, or as soon as it has `max_size` contents.
+    """
+
+    def __init__(self, callback: GroupCallback, window: float = 10, max_size: int = 25):
+        self.callback = callback
+        self.window = window
+        self.max_size = max_size
+
+        self._groups: dict[tuple[str, str], tuple[ExtendedSource, list[Content], asyncio.TimerHandle]] = {}
+        self._tasks: set[asyncio.Task[None]] = set()
+
+        self.contents = 0
+        self.groups = 0
+
+    def add(self, src: ExtendedSource, content: Content) -> None:
+        key = (src.name, content.sub_id)
+        if (group := self._groups.get(key)) is None:
+            timer = asyncio.get_running_loop().call_later(self.window, self._flush, key)
+            group = self._groups[key] = (src, [], timer)
+        group[1].append(content)
+        self.contents += 1
+
+        if len(group[1]) >= self.max_size:
+            self._flush(key)
+
+    async def close(self) -> None:
+        """Flush all the groups and wait for their callbacks."""
+        for key in list(self._groups):
+            self._flush(key)
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _flush(self, key: tuple[str, str]) -> None:
+        if (group := self._groups.pop(key, None)) is None:
+            return
+        src, contents, timer = group
+        timer.cancel()
+        self.groups += 1
+        if len(contents) > 1:
+            logger.info(__("Coalesced {} contents of {} from {}", len(contents), key[1], src.name))
+
+        task = asyncio.create_task(self._run(src, contents))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, src: ExtendedSource, contents: list[Content]) -> None:
+        try:
+            await self.callback(src, contents)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception(__("Error while notifying {}", ", ".join(content.id for content in contents)))
@@ -1,3 +1,82 @@
+"""Versioned migrations of the database schema.
+
+A patch is never modified once released: changing the schema means appending a new patch with the next version.
+"""
+
+import logging
 from typing import Callable, Coroutine
 
-patchs: list[tuple[int, Callable[[], Coroutine[None, None, None]]]] = []
+import aiosqlite
+
+from utils import BraceMessage as __
+
+logger = logging.getLogger(__name__)
+
+type Patch = Callable[[aiosqlite.Cursor], Coroutine[None, None, None]]
+
+
+async def _index_subscription_content(cursor: aiosqlite.Cursor) -> None:
+    # find the subscribers of a (type, series, language) without scanning the table
+    await cursor.execute("CREATE INDEX IF NOT EXISTS subscription_content ON subscription (type, series, language)")
+
+
+async def _create_genre_subscription(cursor: aiosqlite.Cursor) -> None:
+    # subscriptions to every series of a genre in a language, genre is "*" for every series
+    sql = """
+    CREATE TABLE IF NOT EXISTS genre_subscription (
+        user_id INTEGER,
+        genre TEXT,
+        language TEXT,
+        PRIMARY KEY (user_id, genre, language)
+    )
+    """
+    await cursor.execute(sql)
+
+
+async def _create_direct_messages(cursor: aiosqlite.Cursor) -> None:
+    # the users notified by direct message instead of in the release thread
+    await cursor.execute("CREATE TABLE IF NOT EXISTS dm_user (user_id INTEGER PRIMARY KEY)")
+    # the direct messages being sent, to resume them after a restart
+    await cursor.execute("CREATE TABLE IF NOT EXISTS dm_release (release TEXT PRIMARY KEY, embed TEXT)")
+    sql = """
+    CREATE TABLE IF NOT EXISTS dm_delivery (
+        release TEXT,
+        user_id INTEGER,
+        attempts INTEGER,
+        PRIMARY KEY (release, user_id)
+    )
+    """
+    await cursor.execute(sql)
+
+
+patchs: list[tuple[int, Patch]] = [
+    (1, _index_subscription_content),
+    (2, _create_genre_subscription),
+    (3, _create_direct_messages),
+]
+
+
+async def apply_patchs(db: aiosqlite.Connection) -> None:
+    """Apply the patches that have not been applied yet, in order.
+
+    Each patch is applied in its own transaction along with its record in `database_patchs`, so a failing patch leaves
+    the database as it was before it, and is retried on the next startup.
+    """
+    async with db.execute("SELECT version FROM database_patchs") as cursor:
+        applied = {version for version, in await cursor.fetchall()}
+
+    for version, patch in sorted(patchs, key=lambda p: p[0]):
+        if version in applied:
+            continue
+
+        async with db.cursor() as cursor:
+            # explicit, as sqlite3 doesn't open a transaction implicitly before schema changes
+            await cursor.execute("BEGIN")
+            try:
+                await patch(cursor)
+                await cursor.execute("INSERT INTO database_patchs VALUES (?)", (version,))
+            except BaseException:
+                await db.rollback()
+                raise
+            await db.commit()
+        logger.info(__("Applied database patch {} ({})", version, patch.__name__))
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import sqlite3
+from typing import Any, Iterable
+
+import aiosqlite
+
+from utils import BraceMessage as __
+
+logger = logging.getLogger(__name__)
+
+type Write = tuple[str, Iterable[Any], bool, asyncio.Future[None]]  # (sql, parameters, executemany, future)
+
+
+class DatabaseWriter:
+    """Apply the writes to the database from a queue, on a dedicated connection, committing them in groups.
+
+    A write waits up to `window` seconds for other writes to join its transaction, so a burst of subscriptions costs one
+    commit (one fsync) instead of one per click. `execute` returns once the transaction holding the write is committed.
+
+    The database is switched to WAL mode, so the reads of the other connections are not blocked by the pending writes.
+    """
+
+    def __init__(self, path: str, window: float = 0.05, max_batch: int = 256, log_every: int = 1000):
+        self.path = path
+        self.window = window
+        self.max_batch = max_batch
+        self.log_every = log_every
+
+        self._queue: asyncio.Queue[Write | None] = asyncio.Queue()
+        self._task: asyncio.Task[None] | None = None
+        self._db: aiosqlite.Connection | None = None
+
+        self.writes = 0
+        self.commits = 0
+
+    async def start(self) -> None:
+        self._db = await aiosqlite.connect(self.path)
+        async with self._db.execute("PRAGMA journal_mode=WAL") as cursor:
+            await cursor.fetchall()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Commit the pending writes, then close the connection."""
+        if self._task is None:
+            return
+        self._queue.put_nowait(None)
+        await self._task
+        self._task = None
+        assert self._db is not None  # nosec: B101
+        await self._db.close()
+
+    async def execute(self, sql: str, parameters: Iterable[Any] = ()) -> None:
+        """Execute `sql` and wait until it is committed.
+
+        Raise the error of the statement (e.g. `sqlite3.IntegrityError`) if it failed, without affecting the other
+        writes of the group.
+        """
+        await self._enqueue(sql, parameters, False)
+
+    async def executemany(self, sql: str, parameters: Iterable[Iterable[Any]]) -> None:
+        """Same as `execute`, but for many rows at once. If a row fails, none of them are written."""
+        await self._enqueue(sql, list(parameters), True)
+
+    async def _enqueue(self, sql: str, parameters: Iterable[Any], many: bool) -> None:
+        if self._task is None:
+            raise RuntimeError("The database writer is not started")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((sql, parameters, many, future))
+        await future
+
+    async def _run(self) -> None:
+        closing = False
+        while not closing:
+            batch: list[Write] = []
+            if (first := await self._queue.get()) is not None:
+                batch.append(first)
+                await asyncio.sleep(self.window)
+            else:
+                closing = True
+
+            while len(batch) < self.max_batch and not self._queue.empty():
+                if (write := self._queue.get_nowait()) is None:
+                    closing = True
+                    break
+                batch.append(write)
+
+            if not batch:
+                continue
+            try:
+                await self._commit(batch)
+            except Exception as e:  # pylint: disable=broad-except
+                # e.g. a failing BEGIN or a lost connection, raised to the writes of the batch without stopping the loop
+                logger.exception(__("Failed to write a batch of {} writes", len(batch)))
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                await self._rollback()
+
+    async def _rollback(self) -> None:
+        assert self._db is not None  # nosec: B101
+        try:
+            if self._db.in_transaction:
+                await self._db.rollback()
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Failed to roll back the batch")
+
+    async def _commit(self, batch: list[Write]) -> None:
+        assert self._db is not None  # nosec: B101
+
+        errors: list[sqlite3.Error | None] = []
+        # explicit, otherwise releasing a savepoint outside of a transaction would commit it
+        await self._db.execute("BEGIN")
+        for sql, parameters, many, _ in batch:
+            try:
+                if many:
+                    await self._executemany(sql, parameters)
+                else:
+                    await self._db.execute(sql, parameters)
+            except sqlite3.Error as e:
+                # a failing statement is rolled back by itself, the rest of the transaction is kept
+                errors.append(e)
+            else:
+                errors.append(None)
+
+        try:
+            await self._db.commit()
+        except sqlite3.Error as e:
+            logger.exception(__("Failed to commit {} writes", len(batch)))
+            await self._db.rollback()
+            errors = [error or e for error in errors]
+
+        for (*_, future), error in zip(batch, errors):
+            # cancelled if the caller stopped waiting
+            if future.done():
+                continue
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(error)
+
+        previous, self.writes = self.writes, self.writes + len(batch)
+        self.commits += 1
+        if previous // self.log_every != self.writes // self.log_every:
+            logger.info(__("Database writer: {} writes in {} commits", self.writes, self.commits))
+
+    async def _executemany(self, sql: str, parameters: Iterable[Any]) -> None:
+        assert self._db is not None  # nosec: B101
+        # executemany stops at the first failing row, the savepoint drops the rows written before it
+        await self._db.execute("SAVEPOINT executemany")
+        try:
+            await self._db.executemany(sql, parameters)
+        except sqlite3.Error:
+            await self._db.execute("ROLLBACK TO executemany")
+            raise
+        finally:
+            await self._db.execute("RELEASE executemany")
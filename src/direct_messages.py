@@ -0,0 +1,222 @@
+import asyncio
+import json
+import logging
+from dataclasses import dataclass
+from typing import Iterable
+
+import aiohttp
+import aiosqlite
+import discord
+from cachetools import LRUCache
+
+from db_writer import DatabaseWriter
+from dispatch import RateBudget
+from utils import BraceMessage as __
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class Delivery:
+    release: str
+    user_id: int
+    attempts: int = 0
+    # whether the slots of the user and global budgets are reserved (the delivery was put aside until then)
+    user_reserved: bool = False
+    reserved: bool = False
+
+
+class DirectMessages:
+    """Notify by direct message the users who chose to, instead of mentioning them in the release thread.
+
+    The deliveries are sharded by user over `shards` worker tasks, which share a global rate budget (Discord allows
+    50 requests per second to a bot) and space the messages sent to a same user (5 per 5 seconds per channel).
+    Each delivery is stored in the database before being sent and removed once sent, so a restart resumes the
+    deliveries in progress instead of sending them again. Network and server errors are retried with backoff, while
+    the users who don't accept direct messages are skipped.
+    """
+
+    def __init__(
+        self,
+        client: discord.Client,
+        db: aiosqlite.Connection,
+        writer: DatabaseWriter,
+        shards: int = 16,
+        global_rate: int = 40,
+        max_attempts: int = 5,
+        retry_delay: float = 5,
+        log_every: int = 1000,
+    ):
+        self.client = client
+        self.db = db
+        self.writer = writer
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.log_every = log_every
+
+        self._users: set[int] = set()
+        self._shards: list[asyncio.Queue[Delivery]] = [asyncio.Queue() for _ in range(shards)]
+        self._tasks: list[asyncio.Task[None]] = []
+        self._global_budget = RateBudget(global_rate, 1)
+        # only the recently notified users can still be limited
+        self._user_budgets: LRUCache[int, RateBudget] = LRUCache(maxsize=10_000)
+        # release -> its embed, and the number of deliveries left
+        self._releases: dict[str, tuple[discord.Embed, int]] = {}
+
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+    def enabled(self, user_id: int) -> bool:
+        return user_id in self._users
+
+    async def set_enabled(self, user_id: int, enabled: bool) -> None:
+        if enabled:
+            await self.writer.execute("INSERT OR IGNORE INTO dm_user VALUES (?)", (user_id,))
+            self._users.add(user_id)
+        else:
+            await self.writer.execute("DELETE FROM dm_user WHERE user_id = ?", (user_id,))
+            self._users.discard(user_id)
+
+    async def start(self) -> None:
+        """Load the users who chose direct messages, and resume the deliveries of the last run."""
+        async with self.db.execute("SELECT user_id FROM dm_user") as cursor:
+            self._users = {user_id for user_id, in await cursor.fetchall()}
+
+        async with self.db.execute("SELECT release, embed FROM dm_release") as cursor:
+            embeds = {release: discord.Embed.from_dict(json.loads(embed)) for release, embed in await cursor.fetchall()}
+        async with self.db.execute("SELECT release, user_id, attempts FROM dm_delivery") as cursor:
+            deliveries = await cursor.fetchall()
+
+        self._tasks = [asyncio.create_task(self._work(queue)) for queue in self._shards]
+        for release, embed in embeds.items():
+            self._releases[release] = (embed, 0)
+        orphans = 0
+        for release, user_id, attempts in deliveries:
+            if release not in self._releases:
+                orphans += 1
+                continue
+            embed, remaining = self._releases[release]
+            self._releases[release] = (embed, remaining + 1)
+            self._enqueue(Delivery(release, user_id, attempts))
+        for release in [release for release, (_, remaining) in self._releases.items() if not remaining]:
+            await self._done(release)
+
+        if orphans:
+            # e.g. the release couldn't be stored, nothing to send them
+            await self.writer.execute("DELETE FROM dm_delivery WHERE release NOT IN (SELECT release FROM dm_release)")
+            logger.warning(__("Removed {} direct messages without their release", orphans))
+        if len(deliveries) > orphans:
+            logger.info(
+                __("Resuming {} direct messages of {} releases", len(deliveries) - orphans, len(self._releases))
+            )
+
+    async def close(self) -> None:
+        """Stop the workers. The deliveries in progress are resumed on the next start."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def deliver(self, release: str, embed: discord.Embed, user_ids: Iterable[int]) -> None:
+        """Send `embed` to every user, returning once the deliveries are stored (not sent)."""
+        user_ids = list(user_ids)
+        if not user_ids or release in self._releases:
+            return
+
+        # reserved before storing it, so a release published twice at once (e.g. by two sources) is only delivered once
+        self._releases[release] = (embed, len(user_ids))
+        try:
+            await self.writer.execute("INSERT INTO dm_release VALUES (?, ?)", (release, json.dumps(embed.to_dict())))
+            await self.writer.executemany(
+                "INSERT INTO dm_delivery VALUES (?, ?, 0)", ((release, user_id) for user_id in user_ids)
+            )
+        except BaseException:
+            del self._releases[release]
+            raise
+        for user_id in user_ids:
+            self._enqueue(Delivery(release, user_id))
+
+    def _enqueue(self, delivery: Delivery) -> None:
+        # a user always goes to the same shard, so its budget is only used by one worker
+        self._shards[delivery.user_id % len(self._shards)].put_nowait(delivery)
+
+    async def _work(self, queue: asyncio.Queue[Delivery]) -> None:
+        while True:
+            delivery = await queue.get()
+            try:
+                done = await self._send(delivery)
+            except Exception:  # pylint: disable=broad-except
+                done = True
+                self.failed += 1
+                logger.exception(__("Unexpected error while sending {} to {}", delivery.release, delivery.user_id))
+            if done:
+                try:
+                    await self._finish(delivery)
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception(__("Can't remove the delivery of {} to {}", delivery.release, delivery.user_id))
+
+    async def _send(self, delivery: Delivery) -> bool:
+        """Send the message, or put it aside until its slots. Return whether the delivery is finished."""
+        loop = asyncio.get_running_loop()
+        # a delivery that has to wait is put aside until then, so the worker keeps serving the other users of its
+        # shard. The global slot is only reserved once the user's one is reached, so it isn't wasted meanwhile.
+        if not delivery.user_reserved:
+            if (budget := self._user_budgets.get(delivery.user_id)) is None:
+                budget = self._user_budgets[delivery.user_id] = RateBudget(5, 5)
+            delivery.user_reserved = True
+            if delay := budget.reserve(loop.time()):
+                loop.call_later(delay, self._enqueue, delivery)
+                return False
+        if not delivery.reserved:
+            delivery.reserved = True
+            if delay := self._global_budget.reserve(loop.time()):
+                loop.call_later(delay, self._enqueue, delivery)
+                return False
+        delivery.user_reserved = delivery.reserved = False
+
+        release, user_id = delivery.release, delivery.user_id
+        embed, _ = self._releases[release]
+        try:
+            user = self.client.get_user(user_id) or await self.client.fetch_user(user_id)
+            await user.send(embed=embed)
+        except (discord.DiscordServerError, aiohttp.ClientError, TimeoutError) as e:
+            delivery.attempts += 1
+            if delivery.attempts < self.max_attempts:
+                self.retried += 1
+                logger.debug(__("Error while sending {} to {}, retrying", release, user_id), exc_info=e)
+                await self.writer.execute(
+                    "UPDATE dm_delivery SET attempts = ? WHERE release = ? AND user_id = ?",
+                    (delivery.attempts, release, user_id),
+                )
+                loop.call_later(self.retry_delay * 2 ** (delivery.attempts - 1), self._enqueue, delivery)
+                return False
+            self.failed += 1
+            logger.warning(
+                __("Failed to send {} to {} after {} attempts", release, user_id, delivery.attempts), exc_info=e
+            )
+        except discord.HTTPException as e:
+            # e.g. the user doesn't accept direct messages from the bot anymore, retrying won't help
+            self.failed += 1
+            logger.debug(__("Can't send {} to {}", release, user_id), exc_info=e)
+        else:
+            self.sent += 1
+            if self.sent % self.log_every == 0:
+                logger.info(__("Direct messages: {} sent, {} failed, {} retried", self.sent, self.failed, self.retried))
+        return True
+
+    async def _finish(self, delivery: Delivery) -> None:
+        try:
+            await self.writer.execute(
+                "DELETE FROM dm_delivery WHERE release = ? AND user_id = ?", (delivery.release, delivery.user_id)
+            )
+        finally:
+            # counted even if the delivery couldn't be removed, so the release is still cleaned up
+            embed, remaining = self._releases[delivery.release]
+            self._releases[delivery.release] = (embed, remaining - 1)
+            if remaining == 1:
+                await self._done(delivery.release)
+
+    async def _done(self, release: str) -> None:
+        del self._releases[release]
+        await self.writer.execute("DELETE FROM dm_release WHERE release = ?", (release,))
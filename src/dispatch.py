@@ -0,0 +1,178 @@
+import asyncio
+import itertools
+import logging
+import statistics
+from collections import deque
+from dataclasses import dataclass
+from enum import IntEnum
+from typing import Any, Awaitable, Callable
+
+import aiohttp
+import discord
+
+from utils import BraceMessage as __
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    THREAD = 0  # the subscribers are waiting for it
+    FEED = 1
+
+
+@dataclass(slots=True)
+class Job:
+    channel_id: int
+    send: Callable[[], Awaitable[Any]]
+    description: str
+    enqueued_at: float
+    attempts: int = 0
+    # whether the job already has its slot in the channel budget
+    reserved: bool = False
+
+
+class RateBudget:
+    """Allow `rate` calls per `per` seconds (sliding window)."""
+
+    def __init__(self, rate: int, per: float):
+        self.rate = rate
+        self.per = per
+        self._slots: deque[float] = deque()
+
+    def reserve(self, now: float) -> float:
+        """Reserve the next available slot, and return how long to wait for it."""
+        slot = now if len(self._slots) < self.rate else max(now, self._slots[0] + self.per)
+        self._slots.append(slot)
+        if len(self._slots) > self.rate:
+            self._slots.popleft()
+        return slot - now
+
+
+class Dispatcher:
+    """Send the notifications to Discord from a bounded queue, so the sources callbacks never wait for Discord.
+
+    Worker tasks send the jobs by priority (the subscribers threads before the spam feed). The calls to a same channel
+    are spaced to stay within its rate limit (5 messages every 5 seconds) instead of stalling on discord.py's rate
+    limiter: a job that has to wait for its channel is put aside until then, so the workers keep serving the other
+    channels. Server and network errors are retried with backoff.
+    """
+
+    def __init__(
+        self,
+        workers: int = 4,
+        maxsize: int = 1000,
+        rate: int = 5,
+        per: float = 5,
+        max_attempts: int = 3,
+        retry_delay: float = 2,
+        log_every: int = 100,
+    ):
+        self.workers = workers
+        self.maxsize = maxsize
+        self.rate = rate
+        self.per = per
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.log_every = log_every
+
+        self._queue: asyncio.PriorityQueue[tuple[Priority, int, Job]] = asyncio.PriorityQueue()
+        # submitted jobs that are not done yet: queued, waiting for their slot or a retry, or being sent
+        self._pending = 0
+        self._counter = itertools.count()  # keeps the jobs of a same priority in order
+        self._budgets: dict[int, RateBudget] = {}
+        self._tasks: list[asyncio.Task[None]] = []
+
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.dropped = 0
+        # seconds between the submission of the last jobs and their sending
+        self.latencies: deque[float] = deque(maxlen=1000)
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def close(self, timeout: float = 10) -> None:
+        """Give the pending jobs up to `timeout` seconds to be sent, then stop the workers."""
+        deadline = asyncio.get_running_loop().time() + timeout
+        while self._pending and asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(0.1)
+        if self._pending:
+            logger.warning(__("Dropping {} notifications on close", self._pending))
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, channel_id: int, priority: Priority, send: Callable[[], Awaitable[Any]], description: str) -> bool:
+        """Queue `send` (a call to Discord on `channel_id`) without waiting. Return False if the queue is full."""
+        if self._pending >= self.maxsize:
+            self.dropped += 1
+            logger.warning(__("Dispatch queue full, dropping {}", description))
+            return False
+        self._pending += 1
+        self._put(priority, Job(channel_id, send, description, asyncio.get_running_loop().time()))
+        return True
+
+    def metrics(self) -> dict[str, float]:
+        latencies = sorted(self.latencies)
+        return {
+            "depth": self._pending,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "dropped": self.dropped,
+            "latency_p50": statistics.median(latencies) if latencies else 0,
+            "latency_p99": latencies[int(len(latencies) * 0.99)] if latencies else 0,
+        }
+
+    def _put(self, priority: Priority, job: Job) -> None:
+        self._queue.put_nowait((priority, next(self._counter), job))
+
+    async def _work(self) -> None:
+        while True:
+            priority, _, job = await self._queue.get()
+            try:
+                done = await self._send(priority, job)
+            except Exception:  # pylint: disable=broad-except
+                done = True
+                self.failed += 1
+                logger.exception(__("Unexpected error while sending {}", job.description))
+            if done:
+                self._pending -= 1
+
+    async def _send(self, priority: Priority, job: Job) -> bool:
+        """Return False if the job has been put aside to be sent later."""
+        loop = asyncio.get_running_loop()
+        if not job.reserved:
+            budget = self._budgets.get(job.channel_id)
+            if budget is None:
+                budget = self._budgets[job.channel_id] = RateBudget(self.rate, self.per)
+            job.reserved = True
+            if delay := budget.reserve(loop.time()):
+                loop.call_later(delay, self._put, priority, job)
+                return False
+
+        job.attempts += 1
+        job.reserved = False
+        try:
+            await job.send()
+        except (discord.DiscordServerError, aiohttp.ClientError, TimeoutError) as e:
+            if job.attempts >= self.max_attempts:
+                self.failed += 1
+                logger.error(__("Failed to send {} after {} attempts", job.description, job.attempts), exc_info=e)
+                return True
+            self.retried += 1
+            logger.warning(__("Error while sending {}, retrying", job.description), exc_info=e)
+            loop.call_later(self.retry_delay * 2 ** (job.attempts - 1), self._put, priority, job)
+            return False
+        except discord.HTTPException as e:
+            # the request itself is wrong (missing permissions, unknown channel...), retrying won't help
+            self.failed += 1
+            logger.error(__("Failed to send {}", job.description), exc_info=e)
+        else:
+            self.sent += 1
+            self.latencies.append(loop.time() - job.enqueued_at)
+            if self.sent % self.log_every == 0:
+                logger.info(__("Dispatch: {}", self.metrics()))
+        return True
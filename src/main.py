@@ -1,10 +1,12 @@
 from __future__ import annotations
 
 import asyncio
-import itertools
+import csv
+import functools
+import io
 import logging
 import os
-from typing import Self, Type, cast
+from typing import Literal, Self, Type, cast
 
 import aiosqlite
 import discord
@@ -13,12 +15,18 @@ from discord import ForumChannel, TextChannel, app_commands, ui
 from discord.ext import tasks
 from discord.utils import MISSING
 
+from archive import CbzWriter, Volume
+from autocomplete import AutocompleteTracker
+from chapter_cache import ChapterCache
+from coalesce import Coalescer
 from constants import NEWS_CHANNEL, SPAM_CHANNEL, SPREAD_CHANNEL
-from database_patchs import patchs
+from database_patchs import apply_patchs
+from db_writer import DatabaseWriter
+from direct_messages import DirectMessages
+from dispatch import Dispatcher, Priority
 from searcher import Searcher, SeriesInfos
 from sources import (
     Content,
-    Download,
     DownloadBytes,
     DownloadInProgress,
     DownloadUrl,
@@ -29,17 +37,26 @@ from sources import (
     ScanVFDotNet,
 )
 from sources.news import Melty, News
-from utils import BraceMessage as __
+from subscriptions import ANY_GENRE, Subscriptions
+from transcode import Transcoder
+from utils import BraceMessage as __, join_chunks
 
 logger = logging.getLogger(__name__)
 
 
 class MangaBot(discord.AutoShardedClient):
     db: aiosqlite.Connection
+    db_writer: DatabaseWriter
+    chapter_cache: ChapterCache
+    dispatcher: Dispatcher
+    coalescer: Coalescer
+    direct_messages: DirectMessages
+    subscriptions: Subscriptions
     spam_channel: TextChannel
     spread_channel: ForumChannel
     sources: list[ExtendedSource] = [ScanVFDotNet(), Gazes(), MangaScanDotMe(), ScanMangaVFDotMe()]
-    searcher = Searcher(*sources)
+    searcher = Searcher(*sources, snapshot_path="data/catalog.snapshot")
+    transcoder = Transcoder()
 
     def __init__(self):
         intents = discord.Intents.default()
@@ -54,7 +71,25 @@ class MangaBot(discord.AutoShardedClient):
         self.db = await aiosqlite.connect("data/db.sqlite")
 
         await self.init_db()
-        await self.searcher.build_cache()
+        self.db_writer = DatabaseWriter("data/db.sqlite")
+        await self.db_writer.start()
+        self.subscriptions = Subscriptions(self.db, self.db_writer)
+        await self.subscriptions.load()
+        self.direct_messages = DirectMessages(self, self.db, self.db_writer)
+        # the pages too big for a full batch (10 pages) to fit in a message are re-encoded, whatever the guild
+        self.chapter_cache = ChapterCache(
+            "data/chapters",
+            max_bytes=2 * 1024**3,
+            transcoder=self.transcoder,
+            max_page_size=discord.utils.DEFAULT_FILE_SIZE_LIMIT_BYTES // 10,
+        )
+        await self.chapter_cache.start()
+        self.diffs_logger = asyncio.create_task(log_catalog_diffs())
+        # serve the catalog of the last run right away, the first refresh reconciles it in the background
+        loaded = self.searcher.load_snapshot()
+        refresh_all.start()
+        if not loaded:
+            await self.searcher.wait_until_built()
 
         async def getch_channel[T](id: int, assert_type: Type[T]) -> T:
             tmp = self.get_channel(id) or await self.fetch_channel(id)
@@ -67,6 +102,10 @@ class MangaBot(discord.AutoShardedClient):
         self.spread_channel = await getch_channel(SPREAD_CHANNEL, ForumChannel)
 
         self.add_view(DownloadView())
+        self.dispatcher = Dispatcher()
+        self.dispatcher.start()
+        self.coalescer = Coalescer(notify)
+        await self.direct_messages.start()
 
     async def init_db(self):
         async with self.db.cursor() as cursor:
@@ -83,12 +122,23 @@ class MangaBot(discord.AutoShardedClient):
 
             sql = "CREATE TABLE IF NOT EXISTS database_patchs (version INTEGER)"
             await cursor.execute(sql)
-
-            for patch in patchs:
-                if await cursor.execute("SELECT version FROM database_patchs WHERE version = ?", (patch[0],)):
-                    continue
-                await patch[1]()
-                await cursor.execute("INSERT INTO database_patchs VALUES (?)", (patch[0],))
+        await self.db.commit()
+
+        await apply_patchs(self.db)
+
+    async def close(self):
+        if hasattr(self, "coalescer"):
+            await self.coalescer.close()
+        if hasattr(self, "dispatcher"):
+            await self.dispatcher.close()
+        if hasattr(self, "direct_messages"):
+            await self.direct_messages.close()
+        if hasattr(self, "chapter_cache"):
+            await self.chapter_cache.close()
+        self.transcoder.close()
+        await super().close()
+        if hasattr(self, "db_writer"):
+            await self.db_writer.close()
 
     async def on_ready(self):
         logger.info(__("Logged on as {}!", self.user))
@@ -154,13 +204,6 @@ def get_ref(inter: discord.Interaction) -> tuple[str, str, str, str]:
     return series_type, series_id, lang, ref
 
 
-async def check_subscription(type: str, series: str, language: str):
-    sql = "SELECT user_id FROM subscription WHERE type = ? AND series = ? AND language = ?"
-    async with client.db.cursor() as cursor:
-        req = await cursor.execute(sql, (type, series, language))
-        return await req.fetchall()
-
-
 @client.mediasub.sub_to(Melty(shared_client=True))
 async def on_news(src: mediasub.Source, news: News):
     embed = discord.Embed(
@@ -175,49 +218,116 @@ async def on_news(src: mediasub.Source, news: News):
     await client.news_channel.send(embed=embed)
 
 
+def release_number(content: Content) -> float:
+    number = content.fields["chapter_nb"] if content.type == "manga" else content.fields["episode"]
+    try:
+        return float(number)
+    except (TypeError, ValueError):
+        return float("inf")
+
+
 @client.mediasub.sub_to(*MangaBot.sources)
 async def on_content(src: ExtendedSource, content: Content):
     await client.wait_until_ready()
+    # the releases of a same series are notified together (see `notify`)
+    client.coalescer.add(src, content)
+
+
+async def notify(src: ExtendedSource, contents: list[Content]):
+    contents = sorted(contents, key=release_number)
+    first, content = contents[0], contents[-1]
 
     series = MangaBot.searcher.cache[content.id_name]
 
     match content.type:
         case "manga":
-            embed = discord.Embed(
-                title=f"New chapter of {series.name} !",
-                description=f"**{content.fields['chapter_name'][:80]}** ({content.fields['chapter_nb']})",
-                url=content.fields["url"],
-            )
-
-            thread_name = f"{series.name[:50]} - {content.fields['chapter_name']}"
+            if len(contents) == 1:
+                embed = discord.Embed(
+                    title=f"New chapter of {series.name} !",
+                    description=f"**{content.fields['chapter_name'][:80]}** ({content.fields['chapter_nb']})",
+                    url=content.fields["url"],
+                )
+                thread_name = f"{series.name[:50]} - {content.fields['chapter_name']}"
+            else:
+                embed = discord.Embed(
+                    title=f"{len(contents)} new chapters of {series.name} !",
+                    description="\n".join(
+                        f"**{c.fields['chapter_name'][:80]}** ({c.fields['chapter_nb']})" for c in contents
+                    ),
+                    url=content.fields["url"],
+                )
+                thread_name = (
+                    f"{series.name[:50]} - chapters {first.fields['chapter_nb']} to {content.fields['chapter_nb']}"
+                )
         case "anime":
-            embed = discord.Embed(
-                title=f"New episode of {series.name} !",
-                url=content.fields["url"],
-            )
-            embed.add_field(name="Season", value=content.fields["season"], inline=True)
-            embed.add_field(name="Episode", value=content.fields["episode"], inline=True)
+            if len(contents) == 1:
+                embed = discord.Embed(
+                    title=f"New episode of {series.name} !",
+                    url=content.fields["url"],
+                )
+                embed.add_field(name="Season", value=content.fields["season"], inline=True)
+                embed.add_field(name="Episode", value=content.fields["episode"], inline=True)
+                episodes = f"episode {content.fields['episode']}"
+            else:
+                embed = discord.Embed(
+                    title=f"{len(contents)} new episodes of {series.name} !",
+                    url=content.fields["url"],
+                )
+                embed.add_field(name="Season", value=content.fields["season"], inline=True)
+                embed.add_field(
+                    name="Episodes", value=", ".join(str(c.fields["episode"]) for c in contents), inline=True
+                )
+                episodes = f"episodes {first.fields['episode']} to {content.fields['episode']}"
 
-            thread_name = f"{series.name[:50]} - {content.fields['season'][:50]} - episode {content.fields['episode']}"
+            thread_name = f"{series.name[:50]} - {content.fields['season'][:50]} - {episodes}"
 
     if series.thumbnail:
         embed.set_thumbnail(url=series.thumbnail)
     embed.add_field(name="Language", value=content.lang, inline=True)
     embed.add_field(name="Source", value=src.name, inline=True)
+    # the download button gets the last release
     embed.set_footer(text=content.id)
 
     view = DownloadView()
-    await client.spam_channel.send(embed=embed, view=view)
+    client.dispatcher.submit(
+        client.spam_channel.id,
+        Priority.FEED,
+        lambda: client.spam_channel.send(embed=embed, view=view),
+        f"the announcement of {content.id}",
+    )
 
-    if not (results := await check_subscription(content.type, content.id_name, content.lang)):
+    subscribers = client.subscriptions.subscribers(content.type, content.id_name, content.lang, series.genres)
+    if not subscribers:
         return
+    # downloaded before the first subscriber clicks on the button
+    client.chapter_cache.prefetch(src, content.id)
 
-    await client.spread_channel.create_thread(
-        name=thread_name,
-        embed=embed,
-        view=view,
-        content=", ".join(f"<@{user_id}>" for user_id, in results),
-    )
+    try:
+        await client.direct_messages.deliver(
+            content.id, embed, (user_id for user_id in subscribers if client.direct_messages.enabled(user_id))
+        )
+    except Exception:  # pylint: disable=broad-except
+        # the other subscribers are still notified in the thread
+        logger.exception(__("Failed to store the direct messages of {}", content.id))
+    mentions = [f"<@{user_id}>" for user_id in subscribers if not client.direct_messages.enabled(user_id)]
+    if not mentions:
+        return
+    # a message can't be longer than 2000 characters, the other mentions are sent in the thread
+    first_chunk, *other_chunks = join_chunks(mentions, ", ", 2000)
+
+    async def create_thread():
+        thread, _ = await client.spread_channel.create_thread(
+            name=thread_name, embed=embed, view=view, content=first_chunk
+        )
+        for i, chunk in enumerate(other_chunks):
+            client.dispatcher.submit(
+                thread.id,
+                Priority.THREAD,
+                functools.partial(thread.send, chunk),
+                f"the mentions {i + 2}/{len(other_chunks) + 1} of {content.id}",
+            )
+
+    client.dispatcher.submit(client.spread_channel.id, Priority.THREAD, create_thread, f"the thread of {content.id}")
 
 
 @client.tree.command()
@@ -232,11 +342,14 @@ async def search(inter: discord.Interaction, name_id: str):
     await inter.response.send_message(embed=embed, view=view)
 
 
+autocomplete_tracker = AutocompleteTracker()
+
+
 @search.autocomplete(name="name_id")
 async def search_autocomplete(inter: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:
-    return list(
-        app_commands.Choice(name=e.name, value=id_name) for id_name, e in await MangaBot.searcher.search(current)
-    )[:25]
+    async with autocomplete_tracker.track(inter):
+        results = await MangaBot.searcher.search(current)
+    return list(app_commands.Choice(name=e.name, value=id_name) for id_name, e in results)[:25]
 
 
 @client.tree.command()
@@ -244,30 +357,186 @@ async def get_status(inter: discord.Interaction) -> None:
     tmp: list[str] = []
     for src in MangaBot.sources:
         tmp.append(f"[{src.name}]({src.url}) : {src.status.value}")
+    metrics = client.dispatcher.metrics()
+    tmp.append(
+        f"\nNotifications queue : {metrics['depth']} pending, "
+        f"sent in {metrics['latency_p50']:.1f}s (p50) / {metrics['latency_p99']:.1f}s (p99)"
+    )
+    cache = client.chapter_cache.metrics()
+    tmp.append(
+        f"Chapters cache : {cache['hit_ratio']:.0%} hits, {cache['bytes_saved'] / 1024**2:.0f} MiB saved, "
+        f"{cache['size'] / 1024**2:.0f} MiB used"
+    )
     embed = discord.Embed(title="Sources status :", description="\n".join(tmp))
     await inter.response.send_message(embed=embed)
 
 
 @client.tree.command()
 async def get_subscriptions(inter: discord.Interaction) -> None:
-    sql = """SELECT series, language, type FROM subscription WHERE user_id = ?"""
+    # an embed can't have more than 25 fields
+    page = await anext(client.subscriptions.of_user(inter.user.id, page_size=26), [])
 
-    req = await client.db.execute(sql, (inter.user.id,))
-    res = await req.fetchall()
+    genres = await client.subscriptions.genres_of_user(inter.user.id)
 
     embed = discord.Embed(title="Your subscriptions :")
-    for series, language, type_ in res:
+    if genres:
+        embed.description = "Genres: " + ", ".join(
+            f"{'any' if genre == ANY_GENRE else genre} ({language})" for genre, language in genres
+        )
+    for type_, series, language in page[:25]:
         content = MangaBot.searcher.cache.get(series)
         if not content:
             continue
         embed.add_field(name=content.name, value=f"{language} - {type_}")
+    if len(page) > 25:
+        embed.set_footer(text="Only the first 25 are shown, use /export_subscriptions to get all of them.")
 
     await inter.response.send_message(embed=embed)
 
 
+@client.tree.command()
+@app_commands.describe(mode="In the release thread (by default), or by direct message.")
+async def notifications(inter: discord.Interaction, mode: Literal["thread", "direct message"]) -> None:
+    """Choose how you get notified of the new releases you are subscribed to."""
+    await client.direct_messages.set_enabled(inter.user.id, mode == "direct message")
+    await inter.response.send_message(f"You will be notified by {mode} !", ephemeral=True)
+
+
+@client.tree.command()
+@app_commands.describe(
+    language="The language of the series.",
+    genre="Only the series of this genre (by default, every new chapter or episode in this language).",
+)
+async def subscribe_genre(inter: discord.Interaction, language: str, genre: str | None = None) -> None:
+    """Get notified of every new chapter or episode of a genre."""
+    if genre is not None and genre not in MangaBot.searcher.genres:
+        return await inter.response.send_message("Unknown genre", ephemeral=True)
+    await client.subscriptions.subscribe_genre(inter.user.id, genre or ANY_GENRE, language)
+    await inter.response.send_message("You have been subscribed !", ephemeral=True)
+
+
+@client.tree.command()
+async def unsubscribe_genre(inter: discord.Interaction, language: str, genre: str | None = None) -> None:
+    await client.subscriptions.unsubscribe_genre(inter.user.id, genre or ANY_GENRE, language)
+    await inter.response.send_message("You have been unsubscribed !", ephemeral=True)
+
+
+@subscribe_genre.autocomplete(name="genre")
+@unsubscribe_genre.autocomplete(name="genre")
+async def genre_autocomplete(inter: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:
+    # most common genres first
+    genres = sorted(MangaBot.searcher.genres.items(), key=lambda item: len(item[1]), reverse=True)
+    current = current.lower()
+    return [app_commands.Choice(name=genre, value=genre) for genre, _ in genres if current in genre.lower()][:25]
+
+
+SUBSCRIPTIONS_HEADER = ("series", "type", "language", "name")
+MAX_IMPORTED_NAMES = 500
+
+
+@client.tree.command()
+async def export_subscriptions(inter: discord.Interaction) -> None:
+    """Get all your subscriptions as a CSV file, that can be given back to /import_subscriptions."""
+    await inter.response.defer(ephemeral=True, thinking=True)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(SUBSCRIPTIONS_HEADER)
+    count = 0
+    async for page in client.subscriptions.of_user(inter.user.id):
+        for type_, series, language in page:
+            content = MangaBot.searcher.cache.get(series)
+            writer.writerow((series, type_, language, content.name if content else ""))
+        count += len(page)
+
+    file = discord.File(io.BytesIO(buffer.getvalue().encode()), filename="subscriptions.csv")
+    await inter.followup.send(f"You have {count} subscriptions.", file=file, ephemeral=True)
+
+
+@client.tree.command()
+@app_commands.describe(
+    names="Series names, separated by commas.",
+    file="A text file with a series name per line, or a file from /export_subscriptions.",
+    type="Only subscribe to this type (by default, every type available).",
+    language="Only subscribe to this language (by default, every language available).",
+)
+async def import_subscriptions(
+    inter: discord.Interaction,
+    names: str | None = None,
+    file: discord.Attachment | None = None,
+    type: Literal["manga", "anime"] | None = None,
+    language: str | None = None,
+) -> None:
+    """Subscribe to many series at once."""
+    await inter.response.defer(ephemeral=True, thinking=True)
+
+    queries = [name.strip() for name in (names or "").split(",") if name.strip()]
+    exported: list[tuple[str, str, str]] = []
+    if file is not None:
+        lines = (await file.read()).decode(errors="replace").splitlines()
+        if lines and tuple(lines[0].split(",")) == SUBSCRIPTIONS_HEADER:
+            exported = [(row[1], row[0], row[2]) for row in csv.reader(lines[1:]) if len(row) >= 3]
+        else:
+            queries.extend(line.strip() for line in lines if line.strip())
+
+    if len(queries) + len(exported) > MAX_IMPORTED_NAMES:
+        return await inter.followup.send(
+            f"Too many series, you can import up to {MAX_IMPORTED_NAMES} names at once.", ephemeral=True
+        )
+
+    report: list[str] = []
+    keys: list[tuple[str, str, str]] = []
+    for type_, series_id, lang in exported:
+        if (type and type_ != type) or (language and lang != language):
+            continue
+        # the file comes from the user, only the series available in the catalog are kept
+        series_infos = MangaBot.searcher.cache.get(series_id)
+        if series_infos is None or lang not in series_infos.types.get(type_, {}):
+            report.append(f"{series_id} ({lang} - {type_}) -> not found")
+            continue
+        keys.append((type_, series_id, lang))
+    for query, result in zip(queries, await MangaBot.searcher.resolve(queries)):
+        if result is None:
+            report.append(f"{query} -> not found")
+            continue
+        series_id, series_infos = result
+        matching = [
+            (type_, series_id, lang)
+            for type_, langs in series_infos.types.items()
+            if not type or type_ == type
+            for lang in langs
+            if not language or lang == language
+        ]
+        keys.extend(matching)
+        available = ", ".join(f"{lang} - {type_}" for type_, _, lang in matching) or "not available"
+        report.append(f"{query} -> {series_infos.name} ({available})")
+
+    imported = await client.subscriptions.subscribe_many(inter.user.id, keys) if keys else 0
+
+    report_file = discord.File(io.BytesIO("\n".join(report).encode()), filename="import.txt") if report else MISSING
+    await inter.followup.send(f"{imported} subscriptions imported !", file=report_file, ephemeral=True)
+
+
 @tasks.loop(hours=1)
 async def refresh_all():
-    await MangaBot.searcher.build_cache()
+    try:
+        await MangaBot.searcher.build_cache(incremental=True)
+    except Exception:  # pylint: disable=broad-except
+        # the loop would stop otherwise, the catalog is kept as is until the next refresh
+        logger.exception("Failed to refresh the catalog")
+
+
+async def log_catalog_diffs():
+    async for diff in MangaBot.searcher.diffs():
+        logger.info(
+            __(
+                "Catalog of {} updated: {} added, {} removed, {} changed",
+                diff.source,
+                len(diff.added),
+                len(diff.removed),
+                len(diff.changed),
+            )
+        )
 
 
 class SubscriptionView(ui.View):
@@ -285,10 +554,7 @@ class SubscriptionView(ui.View):
 
     @ui.button(label="Unsubscribe", style=discord.ButtonStyle.danger)
     async def unsubscribe(self, inter: discord.Interaction, button: ui.Button[Self]):
-        sql = """DELETE FROM subscription WHERE user_id = ? AND series = ?"""
-
-        await client.db.execute(sql, (inter.user.id, self.series_id))
-        await client.db.commit()
+        await client.subscriptions.unsubscribe(inter.user.id, self.series_id)
         await inter.response.send_message("You have been unsubscribed (from all, because la flemme)!", ephemeral=True)
 
 
@@ -321,10 +587,7 @@ class SubscriptionLangView(ui.View):
 
     @ui.select(cls=ui.Select, placeholder="Language")
     async def select_lang(self, inter: discord.Interaction, select: ui.Select[Self]):
-        async with client.db.cursor() as cursor:
-            sql = """INSERT INTO subscription VALUES (?, ?, ?, ?)"""
-            await cursor.execute(sql, (inter.user.id, self.type, self.series_id, select.values[0]))
-            await client.db.commit()
+        await client.subscriptions.subscribe(inter.user.id, self.type, self.series_id, select.values[0])
         await inter.response.send_message("You have been subscribed !", ephemeral=True)
 
 
@@ -367,9 +630,21 @@ class SourceSelect(ui.View):
         super().__init__()
 
         self.ref = ref
+        self.archive = False
         for src in sources:
             self.select_type.add_option(label=src.name)
 
+    @ui.select(
+        cls=ui.Select,
+        options=[
+            discord.SelectOption(label="Images", value="images", default=True),
+            discord.SelectOption(label="CBZ archive", value="cbz"),
+        ],
+    )
+    async def select_format(self, inter: discord.Interaction, select: ui.Select[Self]):
+        self.archive = select.values[0] == "cbz"
+        await inter.response.defer()
+
     @ui.select(cls=ui.Select, placeholder="Source")
     async def select_type(self, inter: discord.Interaction, select: ui.Select[Self]):
         await inter.response.defer(thinking=True, ephemeral=True)
@@ -377,36 +652,81 @@ class SourceSelect(ui.View):
         source_name = select.values[0]
         source = next(s for s in MangaBot.sources if s.name == source_name)
 
+        # sent by batches as soon as they are downloaded, so the first pages are uploaded while the others download
+        sizes = {DownloadBytes: 10, DownloadUrl: 5}
+        batch: list[DownloadBytes | DownloadUrl] = []
+        batch_bytes = 0
+        max_size = inter.guild.filesize_limit if inter.guild else discord.utils.DEFAULT_FILE_SIZE_LIMIT_BYTES
+        downloads = client.chapter_cache.download(source, self.ref)
+        archive = None
+        if self.archive:
+            # volumes as big as the upload limit, so a chapter is sent in as few messages as possible
+            archive = CbzWriter(" ".join(self.ref.split("/")[1:]), max_size)
         try:
-            tmp: list[Download] = []
-            elements_type: type[Download] = DownloadBytes
-            async for download in source.download(self.ref):
+            async for download in downloads:
                 match download:
-                    case DownloadBytes():
-                        tmp.append(download)
-                        elements_type = DownloadBytes
-                    case DownloadUrl():
-                        tmp.append(download)
-                        elements_type = DownloadUrl
+                    case DownloadBytes() if archive is not None:
+                        if volume := await archive.add(download):
+                            await self._send_volume(inter, volume)
+                    case DownloadBytes() | DownloadUrl():
+                        size = download.data.seek(0, io.SEEK_END) if isinstance(download, DownloadBytes) else 0
+                        if batch and (type(batch[0]) is not type(download) or batch_bytes + size > max_size):
+                            await self._send_batch(inter, batch)
+                            batch, batch_bytes = [], 0
+                        batch.append(download)
+                        batch_bytes += size
+                        if len(batch) >= sizes[type(download)]:
+                            await self._send_batch(inter, batch)
+                            batch, batch_bytes = [], 0
                     case DownloadInProgress():
                         await inter.edit_original_response(
                             content=f"Download in progress... {download.progression}% (ETA: {download.remaining_time}s)"
                         )
+            if archive is not None and (volume := await archive.finish()):
+                await self._send_volume(inter, volume)
+            if archive is not None and archive.skipped:
+                skipped = ", ".join(archive.skipped)
+                await inter.followup.send(f"Skipped the pages too big to be sent: {skipped}", ephemeral=True)
+            if batch:
+                await self._send_batch(inter, batch)
+                batch = []
         except Exception as e:
             await inter.followup.send(f"Error: {e}. Please try with another source.", ephemeral=True)
-            return
-
-        sizes = {DownloadBytes: 10, DownloadUrl: 5}
-        for chunk in itertools.batched(tmp, sizes[elements_type]):
-            if elements_type is DownloadBytes:
-                chunk = cast(list[DownloadBytes], chunk)
+        finally:
+            if archive is not None:
+                archive.close()
+            # the pages not sent because of an error
+            for d in batch:
+                if isinstance(d, DownloadBytes):
+                    d.data.close()
+
+    @staticmethod
+    async def _send_batch(inter: discord.Interaction, batch: list[DownloadBytes | DownloadUrl]) -> None:
+        if isinstance(batch[0], DownloadBytes):
+            files = cast(list[DownloadBytes], batch)
+            for d in files:
+                d.data.seek(0)
+            try:
                 await inter.followup.send(
-                    files=[discord.File(d.data, filename=d.filename, spoiler=True) for d in chunk], ephemeral=True
+                    files=[discord.File(d.data, filename=d.filename, spoiler=True) for d in files], ephemeral=True
                 )
-            elif elements_type is DownloadUrl:
-                chunk = cast(list[DownloadUrl], chunk)
-                await inter.followup.send("\n".join(d.url for d in chunk), ephemeral=True)
+            finally:
+                # released as soon as they are uploaded
+                for d in files:
+                    d.data.close()
+        else:
+            urls = cast(list[DownloadUrl], batch)
+            await inter.followup.send("\n".join(d.url for d in urls), ephemeral=True)
+
+    @staticmethod
+    async def _send_volume(inter: discord.Interaction, volume: Volume) -> None:
+        with volume.file:
+            await inter.followup.send(
+                file=discord.File(volume.file, filename=volume.filename, spoiler=True), ephemeral=True
+            )
 
 
 if __name__ == "__main__":
+    # forked before the bot starts any thread
+    MangaBot.transcoder.start()
     client.run(os.environ["DISCORD_TOKEN"], root_logger=True, log_level=logging.INFO)
@@ -0,0 +1,351 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import AbstractSet, AsyncGenerator, Callable, Mapping, Sequence
+
+from rapidfuzz import utils
+
+from sources import ExtendedSource, Series
+
+from . import snapshot
+from .index import SearchIndex, rescore
+from .models import (
+    SOURCES,
+    CacheT as CacheT,
+    CatalogDiff as CatalogDiff,
+    ContributionT as ContributionT,
+    FingerprintsT as FingerprintsT,
+    LangCacheT as LangCacheT,
+    SeriesInfos as SeriesInfos,
+    SeriesInfosBuilder,
+    TypeCacheT as TypeCacheT,
+    fingerprint,
+)
+from .results import CachedSearch, ResultsCache
+
+logger = logging.getLogger(__name__)
+
+
+class Searcher:
+    def __init__(
+        self,
+        *sources: ExtendedSource,
+        timeout: float = 300,
+        max_concurrency: int = 4,
+        snapshot_path: str | None = None,
+        offload_min_series: int | None = 20_000,
+        workers: int = -1,
+    ):
+        """
+        Args:
+            timeout: maximum time given to a source to list its series.
+            max_concurrency: how many sources are listed at the same time.
+            snapshot_path: where to save the catalog after each build (see `load_snapshot`).
+            offload_min_series: from this catalog size, searches are scored in a worker thread instead of blocking the
+                event loop. None to always score in the event loop.
+            workers: how many threads score an offloaded search (-1 for all the cores).
+        """
+        self.sources = sources
+        # registered in order, so the sources bitmasks of SeriesInfos follow the order of `sources`
+        for src in sources:
+            SOURCES.id(src.name)
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.snapshot_path = snapshot_path
+        self.offload_min_series = offload_min_series
+        self.workers = workers
+
+        self._cache: CacheT | None = None
+        self._index: SearchIndex | None = None
+        # _genres[genre] -> the keys of the series of that genre
+        self._genres: dict[str, set[str]] = {}
+        # _fingerprints[source name] -> the fingerprints of the series it returned the last time it succeeded, to
+        # compute its diff (the series themselves are only kept in the merged cache)
+        self._fingerprints: dict[str, FingerprintsT] = {}
+        # the series that couldn't be rebuilt because a source listing them failed, rebuilt once they all answer
+        self._stale: set[str] = set()
+        self._build_lock = asyncio.Lock()
+        self._diffs_queues: list[asyncio.Queue[CatalogDiff]] = []
+        self._built = asyncio.Event()
+        self._build_error: Exception | None = None
+        self._executor: ThreadPoolExecutor | None = None
+
+        # incremented every time the cache changes, to invalidate what has been computed from it
+        self.generation = 0
+        self.results = ResultsCache()
+
+    @property
+    def cache(self) -> CacheT:
+        if self._cache is None:
+            raise RuntimeError("Cache not built")
+        return self._cache
+
+    @property
+    def index(self) -> SearchIndex:
+        if self._index is None:
+            raise RuntimeError("Cache not built")
+        return self._index
+
+    @property
+    def genres(self) -> Mapping[str, AbstractSet[str]]:
+        """Inverted index of the cache: genre -> keys of the series of that genre."""
+        return self._genres
+
+    async def _fetch(self, src: ExtendedSource, semaphore: asyncio.Semaphore) -> list[Series] | None:
+        async with semaphore:
+            try:
+                async with asyncio.timeout(self.timeout):
+                    return list(await src.get_all())
+            except TimeoutError:
+                logger.warning(f"Timed out while getting all elements of {src.name}")
+            except Exception as e:
+                logger.warning(f"Error while getting all elements of {src.name}", exc_info=e)
+        return None
+
+    async def build_cache(self, incremental: bool = False) -> None:
+        """Fetch every source and update the cache.
+
+        With `incremental`, only the series whose contributions changed are rebuilt and the index is patched instead
+        of being rebuilt entirely (falls back to a full build if there is no cache yet).
+        """
+        async with self._build_lock:
+            try:
+                semaphore = asyncio.Semaphore(self.max_concurrency)
+                results = await asyncio.gather(*(self._fetch(src, semaphore) for src in self.sources))
+
+                # only the sources that answered, the others keep their series of the last time in the cache
+                contributions: dict[str, ContributionT] = {}
+                fingerprints = {src.name: self._fingerprints.get(src.name, {}) for src in self.sources}
+                diffs: list[CatalogDiff] = []
+                for src, result in zip(self.sources, results):
+                    if result is None:
+                        continue
+
+                    current: ContributionT = {}
+                    for element in result:
+                        current.setdefault(element.id_name, []).append(element)
+                    contributions[src.name] = current
+                    previous = fingerprints[src.name]
+                    fingerprints[src.name] = {key: fingerprint(elements) for key, elements in current.items()}
+                    diffs.append(CatalogDiff.compute(src.name, previous, fingerprints[src.name]))
+
+                # a full build would drop the series of the sources that failed
+                failed = len(contributions) < len(self.sources)
+                if (incremental or failed) and self._cache is not None and self._index is not None:
+                    affected = frozenset().union(*(diff.affected for diff in diffs))
+                    self._patch(
+                        contributions, fingerprints, affected if incremental else frozenset(self._cache) | affected
+                    )
+                else:
+                    self._swap(contributions)
+                    self._stale.clear()
+                self._fingerprints = fingerprints
+
+                if self.snapshot_path is not None:
+                    await self._save_snapshot(self.snapshot_path)
+            except Exception as e:
+                if not self._built.is_set():
+                    # nothing to serve: the first build fails loudly instead of leaving its waiters hanging
+                    self._build_error = e
+                    self._built.set()
+                raise
+
+        for diff in diffs:
+            if diff:
+                self._publish(diff)
+
+    async def wait_until_built(self) -> None:
+        """Wait for the cache to be built (or loaded). Raise the error of the first build if it failed."""
+        await self._built.wait()
+        if self._build_error is not None:
+            raise self._build_error
+
+    def load_snapshot(self) -> bool:
+        """Fill the cache from the snapshot written by the last build. Return False if there is no usable snapshot."""
+        if self.snapshot_path is None or (data := snapshot.read(self.snapshot_path)) is None:
+            return False
+        if (loaded := snapshot.loads(data)) is None:
+            return False
+
+        for src in self.sources:
+            if (state := loaded.states.get(src.name)) is not None:
+                src.load_state(state)
+
+        self._cache, self._index = loaded.cache, loaded.index
+        self._fingerprints, self._stale = loaded.fingerprints, loaded.stale
+        self._genres = self._index_genres(loaded.cache)
+        self.generation += 1
+        self._built.set()
+        logger.info(f"Catalog loaded from {self.snapshot_path} ({len(loaded.cache)} series)")
+        return True
+
+    async def _save_snapshot(self, path: str) -> None:
+        states = {src.name: src.dump_state() for src in self.sources}
+        # the build lock is held, so the catalog doesn't change while it is dumped in the thread
+        data = await asyncio.to_thread(
+            snapshot.dumps, self.cache, self.index, self._fingerprints, frozenset(self._stale), states
+        )
+        try:
+            await asyncio.to_thread(snapshot.write, path, data)
+        except OSError as e:
+            logger.warning(f"Error while writing the catalog snapshot to {path}", exc_info=e)
+
+    async def diffs(self) -> AsyncGenerator[CatalogDiff, None]:
+        """Yield the (non-empty) diff of each source, every time the cache is built."""
+        queue: asyncio.Queue[CatalogDiff] = asyncio.Queue(maxsize=100)
+        self._diffs_queues.append(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self._diffs_queues.remove(queue)
+
+    def _publish(self, diff: CatalogDiff) -> None:
+        for queue in self._diffs_queues:
+            try:
+                queue.put_nowait(diff)
+            except asyncio.QueueFull:
+                logger.warning(f"Dropping the diff of {diff.source}: a consumer is too slow")
+
+    def _swap(self, contributions: dict[str, ContributionT]) -> None:
+        cache = self._merge(contributions)
+        # the index is built before the swap so `search` never sees a cache and an index that disagree
+        index = SearchIndex.build((key, (infos.name, *infos.aliases)) for key, infos in cache.items())
+        genres = self._index_genres(cache)
+        self._cache, self._index, self._genres = cache, index, genres
+        self.generation += 1
+        self._build_error = None
+        self._built.set()
+
+    @staticmethod
+    def _index_genres(cache: CacheT) -> dict[str, set[str]]:
+        genres: dict[str, set[str]] = {}
+        for key, infos in cache.items():
+            for genre in infos.genres:
+                genres.setdefault(genre, set()).add(key)
+        return genres
+
+    def _merge(self, contributions: dict[str, ContributionT]) -> CacheT:
+        builders: dict[str, SeriesInfosBuilder] = {}
+
+        for src in self.sources:
+            for key, elements in contributions.get(src.name, {}).items():
+                builder = builders.setdefault(key, SeriesInfosBuilder(name=elements[0].name))
+                for element in elements:
+                    builder.add(src.name, element)
+
+        return {key: builder.build() for key, builder in builders.items()}
+
+    def _merge_one(self, contributions: dict[str, ContributionT], key: str) -> SeriesInfos | None:
+        builder: SeriesInfosBuilder | None = None
+
+        for src in self.sources:
+            for element in contributions.get(src.name, {}).get(key, ()):
+                if builder is None:
+                    builder = SeriesInfosBuilder(name=element.name)
+                builder.add(src.name, element)
+
+        return builder and builder.build()
+
+    def _patch(
+        self, contributions: dict[str, ContributionT], fingerprints: dict[str, FingerprintsT], affected: frozenset[str]
+    ) -> None:
+        """Rebuild the `affected` series (and the stale ones) from the `contributions` of the sources that answered."""
+        failed = [fingerprints[src.name] for src in self.sources if src.name not in contributions]
+        updated: CacheT = {}
+        removed: list[str] = []
+        for key in affected | self._stale:
+            if any(key in listed for listed in failed):
+                # the series of a failed source are not kept, the previous version is kept until it answers again
+                self._stale.add(key)
+                continue
+            self._stale.discard(key)
+            if (series_infos := self._merge_one(contributions, key)) is None:
+                removed.append(key)
+            else:
+                updated[key] = series_infos
+
+        index = self.index.patch({key: (infos.name, *infos.aliases) for key, infos in updated.items()}, removed)
+
+        # no await from here, so the cache and the index are updated at once
+        cache = self.cache
+        for key in (*updated, *removed):
+            if (previous := cache.get(key)) is not None:
+                for genre in previous.genres:
+                    if (keys := self._genres.get(genre)) is not None:
+                        keys.discard(key)
+                        if not keys:
+                            del self._genres[genre]
+        for key in removed:
+            cache.pop(key, None)
+        cache.update(updated)
+        for key, infos in updated.items():
+            for genre in infos.genres:
+                self._genres.setdefault(genre, set()).add(key)
+        self._index = index
+        if updated or removed:
+            self.generation += 1
+
+    async def search(self, query: str) -> list[tuple[str, SeriesInfos]]:
+        index, generation = self.index, self.generation
+        normalized = utils.default_process(query)
+
+        if (cached := self.results.get(normalized, generation)) is not None:
+            self.results.hits += 1
+            keys = cached.keys
+        elif index.prefiltered and (prefix := self.results.get_prefix_candidates(normalized, generation)) is not None:
+            # the user is still typing: only the names that were candidates for the beginning of the query are scored.
+            # Below the prefilter threshold, every search scores the whole index, so there are no candidates to reuse.
+            self.results.prefix_hits += 1
+            candidates, origin = prefix
+            keys = rescore(normalized, candidates)
+            self.results.set(
+                normalized, CachedSearch(generation=generation, keys=keys, candidates=candidates, origin=origin)
+            )
+        else:
+            self.results.misses += 1
+            if self.offload_min_series is None or len(index) < self.offload_min_series:
+                keys, candidates = index.search_with_candidates(query)
+            else:
+                keys, candidates = await self._run_in_executor(
+                    functools.partial(index.search_with_candidates, query, workers=self.workers)
+                )
+            # tagged with the generation the search started with, so it's ignored if the cache was refreshed since
+            self.results.set(
+                normalized, CachedSearch(generation=generation, keys=keys, candidates=candidates, origin=normalized)
+            )
+
+        # the cache may have been refreshed in the meantime
+        cache = self.cache
+        return [(key, series_infos) for key in keys if (series_infos := cache.get(key)) is not None]
+
+    async def resolve(self, names: Sequence[str], score_cutoff: float = 85) -> list[tuple[str, SeriesInfos] | None]:
+        """Return the best match of each name, searched in a single batch.
+
+        None for a blank name, or if nothing scores at least `score_cutoff` (WRatio): a name that is not in the catalog
+        would otherwise resolve to an unrelated series. The results cache is bypassed, as the names don't come from a
+        user typing.
+        """
+        index = self.index
+
+        def search_all(workers: int | None) -> list[list[str]]:
+            return [
+                index.search(name, limit=1, workers=workers, score_cutoff=score_cutoff) if name.strip() else []
+                for name in names
+            ]
+
+        # always offloaded: the threshold is for a single search, a batch blocks the loop even on a small catalog
+        small = self.offload_min_series is None or len(index) < self.offload_min_series
+        results = await self._run_in_executor(functools.partial(search_all, None if small else self.workers))
+
+        cache = self.cache
+        return [
+            (keys[0], series_infos) if keys and (series_infos := cache.get(keys[0])) is not None else None
+            for keys in results
+        ]
+
+    async def _run_in_executor[T](self, func: Callable[[], T]) -> T:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="searcher")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func)
@@ -0,0 +1,276 @@
+import itertools
+from array import array
+from collections import Counter
+from dataclasses import dataclass
+from typing import Iterable, Mapping, Self, Sequence
+
+import numpy as np
+from rapidfuzz import fuzz, process, utils
+
+type Candidates = tuple[tuple[str, ...], tuple[str, ...]]  # (names, their keys)
+
+
+def index_grams(text: str) -> set[str]:
+    """Return the trigrams of `text`, and the bigram starting each word (to match 1 character queries)."""
+    padded = f" {text} "
+    grams = {padded[i : i + 3] for i in range(len(padded) - 2)}
+    grams.update(f" {word[0]}" for word in text.split())
+    return grams
+
+
+def query_grams(text: str) -> set[str]:
+    # the last word may still be being typed, so its end is an optional bonus instead of being required
+    padded = f" {text} "
+    grams = {padded[i : i + 3] for i in range(len(padded) - 2)}
+    grams.add(padded[:2])
+    return grams
+
+
+@dataclass(frozen=True, slots=True)
+class IndexSegment:
+    """Flat, read-only list of preprocessed names.
+
+    `choices[i]` is a preprocessed name (or alias) of the series `keys[backref[i]]`, and the choices of `keys[j]` are
+    `choices[starts[j]:starts[j + 1]]`.
+
+    Big segments also have a trigram inverted index (`grams[trigram] -> choices indexes`) used to only score the
+    choices that share the most trigrams with the query.
+    """
+
+    keys: tuple[str, ...]
+    positions: dict[str, int]  # positions[keys[j]] -> j
+    choices: tuple[str, ...]
+    backref: array[int]
+    starts: array[int]
+    grams: dict[str, array[int]]
+
+    # under this size, scanning everything is cheaper than prefiltering
+    prefilter_min_choices = 5_000
+    # how many candidates are scored with WRatio
+    prefilter_candidates = 2_000
+
+    @classmethod
+    def build(cls, entries: Iterable[tuple[str, Iterable[str]]]) -> Self:
+        return cls.from_processed((key, [utils.default_process(name) for name in names]) for key, names in entries)
+
+    @classmethod
+    def from_processed(cls, entries: Iterable[tuple[str, Iterable[str]]]) -> Self:
+        keys: list[str] = []
+        choices: list[str] = []
+        backref = array("I")
+        starts = array("I", [0])
+
+        for i, (key, names) in enumerate(entries):
+            keys.append(key)
+            for name in names:
+                choices.append(name)
+                backref.append(i)
+            starts.append(len(choices))
+
+        return cls.restore(tuple(keys), tuple(choices), backref, starts)
+
+    @classmethod
+    def restore(
+        cls,
+        keys: tuple[str, ...],
+        choices: tuple[str, ...],
+        backref: array[int],
+        starts: array[int],
+        grams: dict[str, array[int]] | None = None,
+    ) -> Self:
+        """Build the segment from its flat arrays, computing the lookup tables that are not given."""
+        if grams is None:
+            grams = cls._build_grams(choices)
+
+        return cls(
+            keys=keys,
+            positions={key: i for i, key in enumerate(keys)},
+            choices=choices,
+            backref=backref,
+            starts=starts,
+            grams=grams,
+        )
+
+    @classmethod
+    def _build_grams(cls, choices: tuple[str, ...]) -> dict[str, array[int]]:
+        grams: dict[str, array[int]] = {}
+        if len(choices) >= cls.prefilter_min_choices:
+            for i, choice in enumerate(choices):
+                for gram in index_grams(choice):
+                    if (posting := grams.get(gram)) is None:
+                        posting = grams[gram] = array("I")
+                    posting.append(i)
+        return grams
+
+    def entries(self, exclude: frozenset[str] = frozenset()) -> Iterable[tuple[str, tuple[str, ...]]]:
+        for i, key in enumerate(self.keys):
+            if key not in exclude:
+                yield key, self.choices[self.starts[i] : self.starts[i + 1]]
+
+    def extract(
+        self,
+        processed_query: str,
+        limit: int,
+        candidates: list[int] | None,
+        workers: int | None = None,
+        score_cutoff: float = 0,
+    ) -> list[tuple[float, str]]:
+        """Return the `limit` best (score, key) among `candidates` (or all the choices if None), best first.
+
+        Only the choices scoring at least `score_cutoff` are returned.
+
+        With `workers`, the scoring is done by `process.cdist` which releases the GIL and spreads the work over
+        `workers` threads (-1 for all the cores), so it is meant to be called outside of the event loop.
+        """
+        if not self.choices:
+            return []
+
+        if workers is not None:
+            return self._extract_cdist(processed_query, limit, workers, candidates, score_cutoff)
+
+        choices: Sequence[str] | dict[int, str] = self.choices
+        if candidates is not None:
+            choices = {i: self.choices[i] for i in candidates}
+
+        result: list[tuple[str, float, int]] = process.extract(
+            processed_query, choices, scorer=fuzz.WRatio, processor=None, limit=limit, score_cutoff=score_cutoff
+        )
+        return [(r[1], self.keys[self.backref[r[2]]]) for r in result]
+
+    def _extract_cdist(
+        self, processed_query: str, limit: int, workers: int, candidates: list[int] | None, score_cutoff: float
+    ) -> list[tuple[float, str]]:
+        positions = np.arange(len(self.choices)) if candidates is None else np.array(candidates)
+        choices = self.choices if candidates is None else [self.choices[i] for i in candidates]
+
+        scores = process.cdist(
+            [processed_query], choices, scorer=fuzz.WRatio, processor=None, dtype=np.float64, workers=workers
+        )[0]
+        best = np.arange(len(scores))
+        if len(scores) > limit:
+            threshold = -np.partition(-scores, limit - 1)[limit - 1]
+            best = np.flatnonzero(scores >= threshold)
+        # same order as `process.extract`: best score first, then first choice first
+        best = best[np.argsort(-scores[best], kind="stable")][:limit]
+        best = best[scores[best] >= score_cutoff]
+        return [(float(scores[i]), self.keys[self.backref[positions[i]]]) for i in best]
+
+    def candidates(self, processed_query: str, limit: int) -> list[int] | None:
+        """Return the choices sharing the most trigrams with the query, or None if everything has to be scored."""
+        if not self.grams:
+            return None
+
+        postings = (posting for gram in query_grams(processed_query) if (posting := self.grams.get(gram)) is not None)
+        counts = Counter(itertools.chain.from_iterable(postings))
+        if len(counts) < limit:
+            # the query is too short or too far from everything, a full scan is needed to fill the results
+            return None
+        return [i for i, _ in counts.most_common(max(limit, self.prefilter_candidates))]
+
+
+EMPTY_SEGMENT = IndexSegment.from_processed(())
+
+
+@dataclass(frozen=True, slots=True)
+class SearchIndex:
+    """Read-only search index that can be patched in O(changes).
+
+    Patched entries are written to a small `delta` segment and their outdated copy in `base` is shadowed through
+    `dead`. Once the delta and the shadowed entries get too big relatively to `base`, everything is compacted back
+    into a new base segment.
+    """
+
+    base: IndexSegment
+    delta: IndexSegment = EMPTY_SEGMENT
+    dead: frozenset[str] = frozenset()
+    dead_choices: int = 0
+
+    compact_ratio = 0.1
+
+    @classmethod
+    def build(cls, entries: Iterable[tuple[str, Iterable[str]]]) -> Self:
+        return cls(base=IndexSegment.build(entries))
+
+    def __len__(self) -> int:
+        return len(self.base.keys) - len(self.dead) + len(self.delta.keys)
+
+    @property
+    def prefiltered(self) -> bool:
+        """Whether the searches only score prefilter candidates, the only ones `search_with_candidates` returns."""
+        return bool(self.base.grams)
+
+    def patch(self, updated: Mapping[str, Iterable[str]], removed: Iterable[str] = ()) -> Self:
+        """Return a new index where `updated` entries are replaced (or added) and `removed` entries are dropped."""
+        outdated = frozenset((*updated, *removed))
+
+        dead = set(self.dead)
+        dead_choices = self.dead_choices
+        for key in outdated.difference(self.dead):
+            if (i := self.base.positions.get(key)) is not None:
+                dead.add(key)
+                dead_choices += self.base.starts[i + 1] - self.base.starts[i]
+
+        delta = IndexSegment.from_processed(
+            (
+                *self.delta.entries(exclude=outdated),
+                *((key, [utils.default_process(name) for name in names]) for key, names in updated.items()),
+            )
+        )
+        index = type(self)(base=self.base, delta=delta, dead=frozenset(dead), dead_choices=dead_choices)
+
+        if len(delta.choices) + dead_choices > self.compact_ratio * len(self.base.choices):
+            return index.compact()
+        return index
+
+    def compact(self) -> Self:
+        return type(self)(
+            base=IndexSegment.from_processed((*self.base.entries(exclude=self.dead), *self.delta.entries()))
+        )
+
+    def search(self, query: str, limit: int = 25, workers: int | None = None, score_cutoff: float = 0) -> list[str]:
+        """Return the keys of the best matches, without duplicates and best first.
+
+        See `IndexSegment.extract` for `workers` and `score_cutoff`.
+        """
+        return self.search_with_candidates(query, limit, workers, score_cutoff)[0]
+
+    def search_with_candidates(
+        self, query: str, limit: int = 25, workers: int | None = None, score_cutoff: float = 0
+    ) -> tuple[list[str], Candidates | None]:
+        """Same as `search`, but also return the names that have been scored, or None if it was the whole index."""
+        processed_query = utils.default_process(query)
+
+        # over-fetch from the base so shadowed entries can't push live ones out of the results
+        base_limit = limit + self.dead_choices
+        base_candidates = self.base.candidates(processed_query, base_limit)
+        hits = [
+            hit
+            for hit in self.base.extract(processed_query, base_limit, base_candidates, workers, score_cutoff)
+            if hit[1] not in self.dead
+        ]
+        delta_candidates = self.delta.candidates(processed_query, limit)
+        hits.extend(self.delta.extract(processed_query, limit, delta_candidates, score_cutoff=score_cutoff))
+        hits.sort(key=lambda hit: hit[0], reverse=True)
+        keys = list(dict.fromkeys(key for _, key in hits[:limit]))
+
+        if base_candidates is None:
+            return keys, None
+
+        choices: list[str] = []
+        choices_keys: list[str] = []
+        for segment, positions in ((self.base, base_candidates), (self.delta, delta_candidates)):
+            for i in range(len(segment.choices)) if positions is None else positions:
+                key = segment.keys[segment.backref[i]]
+                if segment is self.delta or key not in self.dead:
+                    choices.append(segment.choices[i])
+                    choices_keys.append(key)
+        return keys, (tuple(choices), tuple(choices_keys))
+
+
+def rescore(query: str, candidates: Candidates, limit: int = 25) -> list[str]:
+    """Search `query` among names returned by `SearchIndex.search_with_candidates` only."""
+    choices, keys = candidates
+    result: list[tuple[str, float, int]] = process.extract(
+        utils.default_process(query), choices, scorer=fuzz.WRatio, processor=None, limit=limit
+    )
+    return list(dict.fromkeys(keys[r[2]] for r in result))
@@ -0,0 +1,180 @@
+import hashlib
+import sys
+from dataclasses import dataclass, field
+from typing import Iterable, Mapping, Self
+
+from sources import Series
+
+type CacheT = dict[str, SeriesInfos]
+
+type LangCacheT = dict[str, tuple[str, ...]]  # {"lang": ("source1", "source2", ...)}
+type TypeCacheT = dict[str, LangCacheT]  # {"type": LangCacheT}
+
+type ContributionT = dict[str, list[Series]]  # {"id_name": [Series, ...]}
+type FingerprintsT = dict[str, int]  # {"id_name": fingerprint of its series}
+
+
+class Vocabulary:
+    """Append-only table giving a small int id to each distinct string."""
+
+    def __init__(self):
+        self._ids: dict[str, int] = {}
+        self._names: list[str] = []
+
+    def id(self, name: str) -> int:
+        if (id := self._ids.get(name)) is None:
+            id = self._ids[name] = len(self._names)
+            self._names.append(sys.intern(name))
+        return id
+
+    def name(self, id: int) -> str:
+        return self._names[id]
+
+
+# shared by all the catalogs, so the ids (and the source bits) mean the same thing everywhere
+TYPES = Vocabulary()
+LANGS = Vocabulary()
+GENRES = Vocabulary()
+SOURCES = Vocabulary()
+
+
+@dataclass(frozen=True, slots=True, kw_only=True)
+class SeriesInfos:
+    """Merged informations of a series, from all the sources listing it.
+
+    To keep tens of thousands of them small, types, languages and genres are stored as ids (see `Vocabulary`), and the
+    sources providing each (type, language) as a bitmask of source ids. `types` and `genres` give them back as strings.
+    """
+
+    name: str
+    description: str | None = None
+    thumbnail: str | None = None
+    popularity: tuple[int, ...] = ()
+    availability: tuple[tuple[int, int, int], ...] = ()  # ((type id, lang id, sources bitmask), ...)
+    genre_ids: tuple[int, ...] = ()
+    aliases: tuple[str, ...] = ()
+
+    @classmethod
+    def create(
+        cls,
+        *,
+        name: str,
+        description: str | None = None,
+        thumbnail: str | None = None,
+        popularity: Iterable[int] = (),
+        types: Mapping[str, Mapping[str, Iterable[str]]] | None = None,
+        genres: Iterable[str] = (),
+        aliases: Iterable[str] = (),
+    ) -> Self:
+        """Create the series informations from plain strings."""
+        return cls(
+            name=name,
+            description=description,
+            thumbnail=thumbnail,
+            popularity=tuple(popularity),
+            availability=tuple(
+                (TYPES.id(type_), LANGS.id(lang), sources_mask(srcs))
+                for type_, langs in (types or {}).items()
+                for lang, srcs in langs.items()
+            ),
+            genre_ids=tuple(GENRES.id(genre) for genre in genres),
+            aliases=tuple(aliases),
+        )
+
+    @property
+    def types(self) -> TypeCacheT:
+        types: TypeCacheT = {}
+        for type_id, lang_id, mask in self.availability:
+            types.setdefault(TYPES.name(type_id), {})[LANGS.name(lang_id)] = sources_names(mask)
+        return types
+
+    @property
+    def genres(self) -> tuple[str, ...]:
+        return tuple(GENRES.name(id) for id in self.genre_ids)
+
+
+def fingerprint(elements: Iterable[Series]) -> int:
+    """Return a hash of everything the merge uses from `elements`, the same from one process to another."""
+    fields = [(e.name, e.aliases, e.popularity, e.description, e.thumbnail, e.genres, e.lang, e.type) for e in elements]
+    return int.from_bytes(hashlib.blake2b(repr(fields).encode(), digest_size=8).digest())
+
+
+def sources_mask(names: Iterable[str]) -> int:
+    mask = 0
+    for name in names:
+        mask |= 1 << SOURCES.id(name)
+    return mask
+
+
+def sources_names(mask: int) -> tuple[str, ...]:
+    return tuple(SOURCES.name(id) for id in range(mask.bit_length()) if mask >> id & 1)
+
+
+@dataclass(slots=True)
+class SeriesInfosBuilder:
+    """Mutable counterpart of `SeriesInfos`, used while merging the series of all the sources."""
+
+    name: str
+    description: str | None = None
+    thumbnail: str | None = None
+    popularity: list[int] = field(default_factory=list)
+    availability: dict[tuple[int, int], int] = field(default_factory=dict)
+    genre_ids: dict[int, None] = field(default_factory=dict)
+    aliases: dict[str, None] = field(default_factory=dict)
+
+    def add(self, source: str, element: Series) -> None:
+        if self.description is None:
+            self.description = element.description
+        if self.thumbnail is None:
+            self.thumbnail = element.thumbnail
+
+        if element.popularity:
+            self.popularity.append(element.popularity)
+
+        self.genre_ids.update((GENRES.id(genre), None) for genre in element.genres)
+        availability_key = (TYPES.id(element.type), LANGS.id(element.lang))
+        self.availability[availability_key] = self.availability.get(availability_key, 0) | 1 << SOURCES.id(source)
+        self.aliases.update((alias, None) for alias in element.aliases)
+
+    def build(self) -> SeriesInfos:
+        return SeriesInfos(
+            name=self.name,
+            description=self.description,
+            thumbnail=self.thumbnail,
+            popularity=tuple(self.popularity),
+            # grouped by type, like `types` gives them back
+            availability=tuple(
+                (type_id, lang_id, mask)
+                for group in dict.fromkeys(type_id for type_id, _ in self.availability)
+                for (type_id, lang_id), mask in self.availability.items()
+                if type_id == group
+            ),
+            genre_ids=tuple(self.genre_ids),
+            aliases=tuple(self.aliases),
+        )
+
+
+@dataclass(frozen=True, kw_only=True)
+class CatalogDiff:
+    """What changed in the contribution of a source between two cache builds (as sets of `id_name`)."""
+
+    source: str
+    added: frozenset[str]
+    removed: frozenset[str]
+    changed: frozenset[str]
+
+    @classmethod
+    def compute(cls, source: str, previous: FingerprintsT, current: FingerprintsT) -> Self:
+        return cls(
+            source=source,
+            added=frozenset(current.keys() - previous.keys()),
+            removed=frozenset(previous.keys() - current.keys()),
+            changed=frozenset(key for key in current.keys() & previous.keys() if current[key] != previous[key]),
+        )
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.changed)
+
+    @property
+    def affected(self) -> frozenset[str]:
+        return self.added | self.removed | self.changed
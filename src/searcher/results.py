@@ -0,0 +1,51 @@
+from dataclasses import dataclass
+
+from cachetools import LRUCache
+
+from .index import Candidates
+
+
+@dataclass(frozen=True, slots=True)
+class CachedSearch:
+    generation: int
+    keys: list[str]
+    candidates: Candidates | None
+    # the query the candidates have been computed for
+    origin: str
+
+
+class ResultsCache:
+    """LRU of the recent searches, keyed by normalized query.
+
+    Entries are tagged with the catalog generation they were computed from, and are ignored once the catalog changed.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self._entries: LRUCache[str, CachedSearch] = LRUCache(maxsize=maxsize)
+        self.hits = 0
+        self.prefix_hits = 0
+        self.misses = 0
+
+    def get(self, query: str, generation: int) -> CachedSearch | None:
+        entry = self._entries.get(query)
+        if entry is None or entry.generation != generation:
+            return None
+        return entry
+
+    def get_prefix_candidates(self, query: str, generation: int) -> tuple[Candidates, str] | None:
+        """Return the candidates (and their origin) of the longest cached query that `query` extends.
+
+        The candidates must come from a query at least half as long, as they get less relevant as the query grows.
+        Only the prefiltered searches (big catalogs) have candidates.
+        """
+        for i in range(len(query) - 1, 0, -1):
+            entry = self.get(query[:i], generation)
+            if entry is not None and entry.candidates is not None and 2 * len(entry.origin) >= len(query):
+                return entry.candidates, entry.origin
+        return None
+
+    def set(self, query: str, entry: CachedSearch) -> None:
+        self._entries[query] = entry
+
+    def clear(self) -> None:
+        self._entries.clear()
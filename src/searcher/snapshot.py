@@ -0,0 +1,143 @@
+"""On-disk snapshot of the catalog, so the bot can serve searches right after a restart.
+
+The snapshot holds the merged cache, the compacted search index, the fingerprints of what every source contributed to
+the build (so the next refresh can be incremental) and the internal state of each source (e.g. the urls needed to
+download).
+Only builtins are pickled, so renaming a class can't break an existing snapshot: changing the layout requires bumping
+`SNAPSHOT_VERSION`.
+"""
+
+import gc
+import logging
+import os
+import pickle  # nosec: B403  # the snapshot is only written and read by the bot itself
+import zlib
+from array import array
+from dataclasses import dataclass
+from typing import Any
+
+from .index import IndexSegment, SearchIndex
+from .models import CacheT, FingerprintsT, SeriesInfos
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 3
+
+type SeriesInfosRow = tuple[
+    str, str, str | None, str | None, list[int], dict[str, dict[str, list[str]]], list[str], list[str]
+]
+
+
+@dataclass(kw_only=True)
+class Snapshot:
+    cache: CacheT
+    index: SearchIndex
+    fingerprints: dict[str, FingerprintsT]
+    stale: set[str]
+    states: dict[str, Any]
+
+
+def _dump_series_infos(key: str, infos: SeriesInfos) -> SeriesInfosRow:
+    return (
+        key,
+        infos.name,
+        infos.description,
+        infos.thumbnail,
+        list(infos.popularity),
+        {type_: {lang: list(srcs) for lang, srcs in langs.items()} for type_, langs in infos.types.items()},
+        list(infos.genres),
+        list(infos.aliases),
+    )
+
+
+def _load_series_infos(row: SeriesInfosRow) -> tuple[str, SeriesInfos]:
+    key, name, description, thumbnail, popularity, types, genres, aliases = row
+    return key, SeriesInfos.create(
+        name=name,
+        description=description,
+        thumbnail=thumbnail,
+        popularity=popularity,
+        types=types,
+        genres=genres,
+        aliases=aliases,
+    )
+
+
+def dumps(
+    cache: CacheT,
+    index: SearchIndex,
+    fingerprints: dict[str, FingerprintsT],
+    stale: frozenset[str],
+    states: dict[str, Any],
+) -> bytes:
+    segment = index.compact().base
+    payload = {
+        "version": SNAPSHOT_VERSION,
+        "cache": [_dump_series_infos(key, infos) for key, infos in cache.items()],
+        "index": (
+            segment.keys,
+            segment.choices,
+            segment.backref.tobytes(),
+            segment.starts.tobytes(),
+            {gram: posting.tobytes() for gram, posting in segment.grams.items()},
+        ),
+        "fingerprints": fingerprints,
+        "stale": list(stale),
+        "states": states,
+    }
+    return zlib.compress(pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL), level=1)
+
+
+def loads(data: bytes) -> Snapshot | None:
+    """Return None if the snapshot can't be used."""
+    # loading allocates a lot of long-lived containers, which would trigger many useless collections
+    gc.disable()
+    try:
+        return _loads(data)
+    except Exception as e:  # pylint: disable=broad-except
+        # corrupted, or of an unexpected layout (e.g. written by a bugged version): the catalog is rebuilt instead
+        logger.warning("Invalid catalog snapshot", exc_info=e)
+        return None
+    finally:
+        gc.enable()
+
+
+def _loads(data: bytes) -> Snapshot | None:
+    payload = pickle.loads(zlib.decompress(data))  # nosec: B301
+
+    if payload.get("version") != SNAPSHOT_VERSION:
+        logger.info(f"Ignoring catalog snapshot with version {payload.get('version')} (expected {SNAPSHOT_VERSION})")
+        return None
+
+    keys, choices, backref, starts, grams = payload["index"]
+    segment = IndexSegment.restore(
+        keys,
+        choices,
+        array("I", backref),
+        array("I", starts),
+        {gram: array("I", posting) for gram, posting in grams.items()},
+    )
+
+    return Snapshot(
+        cache=dict(map(_load_series_infos, payload["cache"])),
+        index=SearchIndex(base=segment),
+        fingerprints=payload["fingerprints"],
+        stale=set(payload["stale"]),
+        states=payload["states"],
+    )
+
+
+def write(path: str, data: bytes) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    # atomic on POSIX, so a crash while writing never leaves a truncated snapshot behind
+    os.replace(tmp_path, path)
+
+
+def read(path: str) -> bytes | None:
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
@@ -1,12 +1,16 @@
-import io
 from abc import abstractmethod
 from dataclasses import dataclass, field
-from typing import Any, AsyncGenerator, Iterable, Literal
+from typing import IO, Any, AsyncGenerator, Iterable, Literal
 
 from mediasub.source import PullSource
 
+from .buffers import MemoryBudget
+
 type Download = DownloadBytes | DownloadInProgress | DownloadUrl
 
+# the memory shared by all the downloads in progress, the pages that don't fit are written to temporary files
+downloads_memory = MemoryBudget(64 * 1024**2)
+
 
 @dataclass(kw_only=True)
 class Series:
@@ -46,19 +50,33 @@ class Content:
 
 class ExtendedSource(PullSource):
     supports_download: bool = False
+    # whether the downloads are made of pages, which can be stored by the chapter cache (e.g. not a link to a video)
+    prefetchable: bool = False
+    # the memory a download can use within `downloads_memory`
+    download_memory: int = 8 * 1024**2
+    # the JPEG quality of the pages re-encoded to fit in the upload limits, None to send the pages as they are
+    transcode_quality: int | None = None
 
     @abstractmethod
     async def get_all(self) -> Iterable[Series]:
         ...
 
-    async def download(self, ref: str) -> AsyncGenerator[Download, None]:
+    async def download(self, ref: str, background: bool = False) -> AsyncGenerator[Download, None]:
+        """Download the chapter `ref`. A `background` download (e.g. a prefetch) gives way to the others."""
         raise NotImplementedError()
         yield
 
+    def dump_state(self) -> Any:
+        """Return the internal data built by `get_all`, made of builtins only, to be stored in the catalog snapshot."""
+        return None
+
+    def load_state(self, state: Any) -> None:
+        """Restore the internal data returned by `dump_state`."""
+
 
 @dataclass
 class DownloadBytes:
-    data: io.BytesIO
+    data: IO[bytes]  # to be closed by the consumer once used, to release its memory
     filename: str
 
 
@@ -1,14 +1,14 @@
 import asyncio
-import itertools
 import logging
 import re
+from collections import defaultdict
 from dataclasses import dataclass
 from typing import Any, AsyncGenerator, Iterable
 from urllib.parse import urljoin
 
 import feedparser
 import httpx
-from async_lru import alru_cache
+from cachetools import TTLCache
 from mediasub import SourceDown
 from mediasub.source import LastPullContext
 from mediasub.utils import normalize
@@ -48,6 +48,12 @@ class Gazes(ExtendedSource):
         self._cache: dict[str, dict[str, InternalData]] = {}
         # _conversions[ref] -> url
         self._conversions: dict[str, str]
+        # _seasons[lang] -> the seasons, and the same seasons by anime id
+        self._seasons: TTLCache[str | None, tuple[list[dict[str, Any]], dict[int, dict[str, Any]]]] = TTLCache(
+            maxsize=8, ttl=3600
+        )
+        # so concurrent parses wait for the same download instead of each downloading the seasons
+        self._seasons_locks: defaultdict[str | None, asyncio.Lock] = defaultdict(asyncio.Lock)
 
     async def pull(self, last_pull_ctx: LastPullContext | None = None) -> Iterable[Content]:
         try:
@@ -82,9 +88,16 @@ class Gazes(ExtendedSource):
 
             return content
 
-        return [await parse(item) for item in feed.entries[:25]]
+        return await asyncio.gather(*(parse(item) for item in feed.entries[:25]))
+
+    async def _get_seasons(self, lang: str | None = None) -> tuple[list[dict[str, Any]], dict[int, dict[str, Any]]]:
+        async with self._seasons_locks[lang]:
+            if (seasons := self._seasons.get(lang)) is None:
+                raw = await self._fetch_seasons(lang)
+                by_id = {anime_id: season for season in raw for anime_id in season["ids"]}
+                seasons = self._seasons[lang] = (raw, by_id)
+            return seasons
 
-    @alru_cache
     async def _fetch_seasons(self, lang: str | None = None) -> list[dict[str, Any]]:
         params = {}
         if lang is not None:
@@ -98,20 +111,26 @@ class Gazes(ExtendedSource):
         res = await self.client.get(self._seasons_url, params={"id": anime_id})
         if res.status_code != 200 or (raw := res.json())["success"] is False:
             raise SourceDown()
+        if not raw["data"]:
+            # in the feed, but not served by the API yet
+            raise SourceDown(f"Unknown anime: {anime_id}")
         return raw["data"][0]
 
     async def _get_anime(self, anime_id: int) -> dict[str, Any]:
-        seasons = await self._fetch_seasons()
-        return next(season for season in seasons if anime_id in season["ids"])
+        _, by_id = await self._get_seasons()
+        if (anime := by_id.get(anime_id)) is None:
+            # released after the seasons have been fetched
+            anime = by_id[anime_id] = await self._fetch_anime(str(anime_id))
+        return anime
 
     async def get_all(self) -> Iterable[Series]:
-        self._fetch_seasons.cache_clear()
-        self._cache = {}
-        raw_vf = await self._fetch_seasons("vf")
-        raw_vostfr = await self._fetch_seasons("vostfr")
+        self._seasons.clear()
+        (raw_vf, _), (raw_vostfr, _) = await asyncio.gather(self._get_seasons("vf"), self._get_seasons("vostfr"))
+
+        cache: dict[str, dict[str, InternalData]] = {}
 
         def parse_raw(raw: dict[str, Any], lang: str) -> Series:
-            seasons = self._cache.setdefault(normalize(raw["title"]), {})
+            seasons = cache.setdefault(normalize(raw["title"]), {})
             for season in raw["seasons"]:
                 seasons[normalize(season["fiche"]["title"])] = InternalData(id=int(season["fiche"]["id"]))
 
@@ -125,12 +144,24 @@ class Gazes(ExtendedSource):
                 type="anime",
             )
 
-        return itertools.chain(
-            (parse_raw(raw, "vf") for raw in raw_vf),
-            (parse_raw(raw, "vostfr") for raw in raw_vostfr),
-        )
+        result = [
+            *(parse_raw(raw, "vf") for raw in raw_vf),
+            *(parse_raw(raw, "vostfr") for raw in raw_vostfr),
+        ]
+        self._cache = cache
+        return result
+
+    def dump_state(self) -> dict[str, dict[str, int]]:
+        return {
+            series: {season: data.id for season, data in seasons.items()} for series, seasons in self._cache.items()
+        }
+
+    def load_state(self, state: dict[str, dict[str, int]]) -> None:
+        self._cache = {
+            series: {season: InternalData(id=id) for season, id in seasons.items()} for series, seasons in state.items()
+        }
 
-    async def download(self, ref: str) -> AsyncGenerator[Download, None]:
+    async def download(self, ref: str, background: bool = False) -> AsyncGenerator[Download, None]:
         print(ref)
         _, series_id, lang, season, episode = ref.split("/")
         internal_data = self._cache[series_id][season]
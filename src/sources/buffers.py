@@ -0,0 +1,91 @@
+import io
+import tempfile
+from typing import IO
+
+
+class MemoryBudget:
+    """A number of bytes that can be kept in memory, shared with the `parent` budget if any."""
+
+    def __init__(self, max_bytes: int, parent: "MemoryBudget | None" = None):
+        self.max_bytes = max_bytes
+        self.parent = parent
+        self.used = 0
+
+    def reserve(self, size: int) -> bool:
+        """Reserve `size` bytes, if they are available in this budget and its parents."""
+        if self.used + size > self.max_bytes:
+            return False
+        if self.parent is not None and not self.parent.reserve(size):
+            return False
+        self.used += size
+        return True
+
+    def release(self, size: int) -> None:
+        self.used -= size
+        if self.parent is not None:
+            self.parent.release(size)
+
+
+class SpooledBuffer(io.BufferedIOBase):
+    """A file kept in memory as long as `budget` allows it, then moved to a temporary file.
+
+    The memory is released when the buffer is closed, so a buffer must be closed as soon as its content is used.
+    """
+
+    def __init__(self, budget: MemoryBudget):
+        super().__init__()
+        self.budget = budget
+        self._file: IO[bytes] = io.BytesIO()
+        self._reserved = 0
+        self._spooled = False
+
+    @property
+    def spooled(self) -> bool:
+        """Whether the content has been moved to the disk."""
+        return self._spooled
+
+    def write(self, data: bytes) -> int:  # type: ignore
+        if not self._spooled and not self.budget.reserve(len(data)):
+            self._spool()
+        elif not self._spooled:
+            self._reserved += len(data)
+        return self._file.write(data)
+
+    def read(self, size: int | None = -1) -> bytes:
+        return self._file.read(size)
+
+    def read1(self, size: int = -1) -> bytes:
+        return self._file.read(size)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        return self._file.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def readable(self) -> bool:
+        return True
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def close(self) -> None:
+        if not self.closed:
+            self._file.close()
+            self.budget.release(self._reserved)
+            self._reserved = 0
+        super().close()
+
+    def _spool(self) -> None:
+        file = tempfile.TemporaryFile()  # pylint: disable=consider-using-with
+        assert isinstance(self._file, io.BytesIO)  # nosec: B101
+        file.write(self._file.getbuffer())
+        file.seek(self._file.tell())
+        self._file.close()
+        self._file = file
+        self._spooled = True
+        self.budget.release(self._reserved)
+        self._reserved = 0
@@ -1,8 +1,9 @@
-import io
+import asyncio
 import json
 import logging
 import re
 import typing
+from collections import defaultdict
 from typing import Any, AsyncGenerator, Iterable, TypedDict
 
 import feedparser
@@ -14,7 +15,9 @@ from mediasub._logger import BraceMessage as __
 from mediasub.source import LastPullContext
 from mediasub.utils import normalize
 
-from sources import Content, DownloadBytes, ExtendedSource, Series
+from sources import Content, DownloadBytes, ExtendedSource, Series, downloads_memory
+from sources.buffers import MemoryBudget, SpooledBuffer
+from sources.priority import PrioritySemaphore
 
 logger = logging.getLogger(__name__)
 
@@ -33,12 +36,23 @@ class ScanVFDotNet(ExtendedSource):
     name = "ScanVF"  # type: ignore  # TODO
     url = _base_url = "https://www.scan-vf.net/"  # type: ignore  # TODO
     supports_download = True
+    prefetchable = True
+    # some pages are big PNGs
+    transcode_quality = 85
 
     _script_selector = "body > div.container-fluid > script"
 
+    # pages downloaded at the same time from a same host, across all the downloads (the background ones last)
+    max_concurrent_pages = 6
+    page_attempts = 3
+    page_retry_delay = 1.0
+
     def __init__(self, *args: Any, **kwargs: Any):
         super().__init__(*args, **kwargs)
         self._cache: dict[str, InternalData] = {}
+        self._hosts_semaphores: defaultdict[str, PrioritySemaphore] = defaultdict(
+            lambda: PrioritySemaphore(self.max_concurrent_pages)
+        )
 
         self.headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/87.0.4280.88 Safari/537.36",
@@ -103,12 +117,13 @@ class ScanVFDotNet(ExtendedSource):
 
     @typing.override
     async def get_all(self) -> Iterable[Series]:
-        self._cache.clear()
-
         res = await self._get(self._all_url)
         soup = BeautifulSoup(res.text, features="html.parser")
         mangas_tag = soup.select("li > a")
 
+        # filled aside and swapped at the end, so a failed listing doesn't break downloads of known series
+        cache: dict[str, InternalData] = {}
+
         def parse_tag(tag: Tag) -> Series:
             name_tag = tag.select_one("h6")
             match = self._manga_url_reg.match(tag.attrs["href"])
@@ -121,16 +136,26 @@ class ScanVFDotNet(ExtendedSource):
                 lang="fr",
                 type="manga",
             )
-            self._cache[series.ref] = {
+            cache[series.ref] = {
                 "url": tag.attrs["href"],
                 "manga_name": match["manga_name"],
             }
             return series
 
-        return (parse_tag(tag) for tag in mangas_tag)
+        result = [parse_tag(tag) for tag in mangas_tag]
+        self._cache = cache
+        return result
+
+    @typing.override
+    def dump_state(self) -> dict[str, InternalData]:
+        return self._cache
 
     @typing.override
-    async def download(self, ref: str) -> AsyncGenerator[DownloadBytes, None]:
+    def load_state(self, state: dict[str, InternalData]) -> None:
+        self._cache = state
+
+    @typing.override
+    async def download(self, ref: str, background: bool = False) -> AsyncGenerator[DownloadBytes, None]:
         *manga_ref, chapter = ref.split("/")
         internal: InternalData | None = self._cache.get("/".join(manga_ref))
 
@@ -138,14 +163,30 @@ class ScanVFDotNet(ExtendedSource):
             raise ValueError(f"Unknown manga {'/'.join(manga_ref)}")  # TODO: better error
 
         chapter_url = self._chapter_url_fmt.format(manga_name=internal["manga_name"], chapter_nb=chapter)
-        raw_pages = await self._get_pages_raw(chapter_url)
-        for page in raw_pages:
-            filename = self._get_filename(page)
-            page_url = self._get_page_url(internal, chapter, page)
-            yield DownloadBytes(
-                data=await self._download_page(page_url),
-                filename=filename,
-            )
+        raw_pages = list(await self._get_pages_raw(chapter_url))
+
+        # all the pages are downloaded concurrently (within the hosts limits), and yielded in order as soon as possible
+        budget = MemoryBudget(self.download_memory, downloads_memory)
+        tasks = [
+            asyncio.create_task(self._download_page(self._get_page_url(internal, chapter, page), budget, background))
+            for page in raw_pages
+        ]
+        yielded = 0
+        try:
+            for page, task in zip(raw_pages, tasks):
+                data = await task
+                yielded += 1
+                yield DownloadBytes(
+                    data=data,
+                    filename=self._get_filename(page),
+                )
+        finally:
+            # the download failed or has been interrupted, the pages not yielded yet are dropped
+            for task in tasks[yielded:]:
+                if task.done() and not task.cancelled() and task.exception() is None:
+                    task.result().close()
+                else:
+                    task.cancel()
 
     async def _get_pages_raw(self, chapter_url: str) -> Iterable[PageRaw]:
         soup = BeautifulSoup((await self.client.get(chapter_url)).text, features="html.parser")
@@ -160,9 +201,39 @@ class ScanVFDotNet(ExtendedSource):
 
         return json.loads(match.group(1))
 
-    async def _download_page(self, page_url: str) -> io.BytesIO:
-        result = await self._get(page_url)
-        return io.BytesIO(result.content)
+    async def _download_page(self, page_url: str, budget: MemoryBudget, background: bool = False) -> SpooledBuffer:
+        """Download a page, retrying it on its own if it fails.
+
+        The body is streamed into a buffer kept in memory within `budget`, and written to a temporary file beyond.
+        """
+        semaphore = self._hosts_semaphores[httpx.URL(page_url).host]
+        attempt = 1
+        while True:
+            try:
+                async with semaphore.slot(background), self.client.stream("GET", page_url, headers=self.headers) as response:
+                    if response.status_code < 500 and response.status_code != 429:
+                        return await self._read_body(response, budget)
+                error: Exception = SourceDown(f"Status {response.status_code} for {page_url}")
+            except httpx.HTTPError as e:
+                error = SourceDown(e)
+
+            if attempt >= self.page_attempts:
+                raise error
+            logger.warning(__("Error while downloading {}, retrying ({}/{})", page_url, attempt, self.page_attempts))
+            await asyncio.sleep(self.page_retry_delay * 2 ** (attempt - 1))
+            attempt += 1
+
+    @staticmethod
+    async def _read_body(response: httpx.Response, budget: MemoryBudget) -> SpooledBuffer:
+        buffer = SpooledBuffer(budget)
+        try:
+            async for chunk in response.aiter_bytes():
+                buffer.write(chunk)
+        except BaseException:
+            buffer.close()
+            raise
+        buffer.seek(0)
+        return buffer
 
     def _get_page_url(self, internal: InternalData, chapter: str, page: PageRaw) -> str:
         return self._images_url_fmt.format(
@@ -0,0 +1,49 @@
+import asyncio
+import contextlib
+from collections import deque
+from typing import AsyncIterator
+
+
+class PrioritySemaphore:
+    """A semaphore that serves its waiters in order, except the background ones, which wait for the others to be
+    served first.
+    """
+
+    def __init__(self, value: int):
+        self._value = value
+        self._waiters: deque[asyncio.Future[None]] = deque()
+        self._background_waiters: deque[asyncio.Future[None]] = deque()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, background: bool = False) -> AsyncIterator[None]:
+        await self.acquire(background)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, background: bool = False) -> None:
+        if self._value > 0 and not self._waiters and not (background and self._background_waiters):
+            self._value -= 1
+            return
+
+        waiters = self._background_waiters if background else self._waiters
+        future = asyncio.get_running_loop().create_future()
+        waiters.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # the slot was given just before the cancellation
+                self.release()
+            elif future in waiters:
+                waiters.remove(future)
+            raise
+
+    def release(self) -> None:
+        self._value += 1
+        while self._value > 0 and (waiters := self._waiters or self._background_waiters):
+            future = waiters.popleft()
+            if not future.done():
+                self._value -= 1
+                future.set_result(None)
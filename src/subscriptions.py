@@ -0,0 +1,155 @@
+import asyncio
+import logging
+from typing import AsyncGenerator, Iterable
+
+import aiosqlite
+
+from db_writer import DatabaseWriter
+from utils import BraceMessage as __
+
+logger = logging.getLogger(__name__)
+
+type SubscriptionKey = tuple[str, str, str]  # (type, series, language)
+type GenreSubscriptionKey = tuple[str, str]  # (genre, language)
+
+# the genre of a subscription to every series in a language
+ANY_GENRE = "*"
+
+
+class Subscriptions:
+    """In-memory index of the `subscription` and `genre_subscription` tables, to find the subscribers of a content
+    without querying the database.
+
+    The whole tables are loaded at startup, then every change is written to the database first and applied to the
+    index once committed, so the index never holds a subscription that isn't stored.
+    """
+
+    def __init__(self, db: aiosqlite.Connection, writer: DatabaseWriter):
+        self.db = db
+        self.writer = writer
+        self._subscribers: dict[SubscriptionKey, set[int]] = {}
+        # user_id -> its subscriptions, to unsubscribe from a series without scanning the whole index
+        self._by_user: dict[int, set[SubscriptionKey]] = {}
+        self._genre_subscribers: dict[GenreSubscriptionKey, set[int]] = {}
+
+    async def load(self) -> None:
+        self._subscribers.clear()
+        self._by_user.clear()
+        self._genre_subscribers.clear()
+        async with self.db.execute("SELECT user_id, type, series, language FROM subscription") as cursor:
+            async for user_id, type_, series, language in cursor:
+                self._add(user_id, (type_, series, language))
+        async with self.db.execute("SELECT user_id, genre, language FROM genre_subscription") as cursor:
+            async for user_id, genre, language in cursor:
+                self._genre_subscribers.setdefault((genre, language), set()).add(user_id)
+        count = sum(map(len, self._by_user.values()))
+        genre_count = sum(map(len, self._genre_subscribers.values()))
+        logger.info(
+            __(
+                "Loaded {} subscriptions of {} users, and {} genre subscriptions",
+                count,
+                len(self._by_user),
+                genre_count,
+            )
+        )
+
+    def subscribers(self, type: str, series: str, language: str, genres: Iterable[str] = ()) -> tuple[int, ...]:
+        """Return the users subscribed to the series, or to one of its `genres` (or any genre) in that language."""
+        users = set(self._subscribers.get((type, series, language), ()))
+        # one lookup per genre of the series, whatever the number of genre subscriptions
+        for genre in (*genres, ANY_GENRE):
+            users.update(self._genre_subscribers.get((genre, language), ()))
+        return tuple(users)
+
+    # the writes are shielded: once queued, they are committed anyway, so the index must be updated anyway too
+
+    async def subscribe(self, user_id: int, type: str, series: str, language: str) -> None:
+        await asyncio.shield(self._subscribe(user_id, (type, series, language)))
+
+    async def unsubscribe(self, user_id: int, series: str) -> None:
+        """Unsubscribe the user from every type and language of `series`."""
+        await asyncio.shield(self._unsubscribe(user_id, series))
+
+    async def subscribe_many(self, user_id: int, keys: Iterable[SubscriptionKey]) -> int:
+        """Subscribe the user to all `keys` in a single write, and return the number of new subscriptions.
+
+        The subscriptions that already exist are ignored.
+        """
+        return await asyncio.shield(self._subscribe_many(user_id, list(keys)))
+
+    async def subscribe_genre(self, user_id: int, genre: str, language: str) -> None:
+        """Subscribe the user to every series of `genre` (or of any genre with `ANY_GENRE`) in `language`."""
+        await asyncio.shield(self._subscribe_genre(user_id, (genre, language)))
+
+    async def unsubscribe_genre(self, user_id: int, genre: str, language: str) -> None:
+        await asyncio.shield(self._unsubscribe_genre(user_id, (genre, language)))
+
+    async def _subscribe(self, user_id: int, key: SubscriptionKey) -> None:
+        sql = """INSERT INTO subscription VALUES (?, ?, ?, ?)"""
+        await self.writer.execute(sql, (user_id, *key))
+        self._add(user_id, key)
+
+    async def _subscribe_many(self, user_id: int, keys: list[SubscriptionKey]) -> int:
+        existing = self._by_user.get(user_id, set())
+        new = [key for key in dict.fromkeys(keys) if key not in existing]
+        sql = """INSERT OR IGNORE INTO subscription VALUES (?, ?, ?, ?)"""
+        await self.writer.executemany(sql, ((user_id, *key) for key in new))
+        for key in new:
+            self._add(user_id, key)
+        return len(new)
+
+    async def _unsubscribe(self, user_id: int, series: str) -> None:
+        sql = """DELETE FROM subscription WHERE user_id = ? AND series = ?"""
+        await self.writer.execute(sql, (user_id, series))
+
+        keys = self._by_user.get(user_id, set())
+        for key in [key for key in keys if key[1] == series]:
+            keys.discard(key)
+            if (users := self._subscribers.get(key)) is not None:
+                users.discard(user_id)
+                if not users:
+                    del self._subscribers[key]
+        if not keys:
+            self._by_user.pop(user_id, None)
+
+    async def _subscribe_genre(self, user_id: int, key: GenreSubscriptionKey) -> None:
+        sql = """INSERT OR IGNORE INTO genre_subscription VALUES (?, ?, ?)"""
+        await self.writer.execute(sql, (user_id, *key))
+        self._genre_subscribers.setdefault(key, set()).add(user_id)
+
+    async def _unsubscribe_genre(self, user_id: int, key: GenreSubscriptionKey) -> None:
+        sql = """DELETE FROM genre_subscription WHERE user_id = ? AND genre = ? AND language = ?"""
+        await self.writer.execute(sql, (user_id, *key))
+        if (users := self._genre_subscribers.get(key)) is not None:
+            users.discard(user_id)
+            if not users:
+                del self._genre_subscribers[key]
+
+    async def genres_of_user(self, user_id: int) -> list[GenreSubscriptionKey]:
+        sql = """SELECT genre, language FROM genre_subscription WHERE user_id = ? ORDER BY genre, language"""
+        async with self.db.execute(sql, (user_id,)) as cursor:
+            return [tuple(row) for row in await cursor.fetchall()]  # type: ignore
+
+    async def of_user(self, user_id: int, page_size: int = 500) -> AsyncGenerator[list[SubscriptionKey], None]:
+        """Yield the subscriptions of the user, ordered by series, by pages of `page_size`."""
+        # keyset pagination along the primary key, so each page is a range read of the index
+        sql = """
+        SELECT type, series, language FROM subscription
+        WHERE user_id = ? AND (series, language, type) > (?, ?, ?)
+        ORDER BY series, language, type
+        LIMIT ?
+        """
+        last = ("", "", "")
+        while True:
+            async with self.db.execute(sql, (user_id, *last, page_size)) as cursor:
+                page: list[SubscriptionKey] = [tuple(row) for row in await cursor.fetchall()]  # type: ignore
+            if page:
+                yield page
+            if len(page) < page_size:
+                return
+            type_, series, language = page[-1]
+            last = (series, language, type_)
+
+    def _add(self, user_id: int, key: SubscriptionKey) -> None:
+        self._subscribers.setdefault(key, set()).add(user_id)
+        self._by_user.setdefault(user_id, set()).add(key)
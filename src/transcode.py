@@ -0,0 +1,207 @@
+import asyncio
+import io
+import logging
+import math
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from pathlib import PurePath
+from typing import IO, AsyncGenerator
+
+from PIL import Image, UnidentifiedImageError
+
+from sources import Download, DownloadBytes, downloads_memory
+from sources.buffers import SpooledBuffer
+from utils import BraceMessage as __
+
+logger = logging.getLogger(__name__)
+
+
+def recompress(source: str, destination: str, max_size: int, quality: int) -> tuple[int | None, float]:
+    """Re-encode the image `source` as a JPEG in `destination`, downsized until it takes less than `max_size` bytes.
+
+    Return the size of the new image (None if it is not smaller than the original), and the time it took.
+    """
+    start = time.perf_counter()
+    with Image.open(source) as image:
+        image.load()
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+
+        scale = 1.0
+        for _ in range(4):
+            size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            resized = image if scale == 1 else image.resize(size, Image.Resampling.LANCZOS)
+            output = io.BytesIO()
+            resized.save(output, "JPEG", quality=quality, optimize=True)
+            if output.tell() <= max_size:
+                break
+            # the size of a JPEG is roughly proportional to its area
+            scale *= math.sqrt(max_size / output.tell()) * 0.95
+
+    if output.tell() >= os.path.getsize(source):
+        return None, time.perf_counter() - start
+    with open(destination, "wb") as file:
+        file.write(output.getbuffer())
+    return output.tell(), time.perf_counter() - start
+
+
+@dataclass(slots=True)
+class _ChapterStats:
+    pages: int = 0
+    transcoded: int = 0
+    bytes_saved: int = 0
+    time_spent: float = 0
+
+
+class Transcoder:
+    """Re-encode the pages too big for the upload limits (e.g. the big PNGs of some sources), in a pool of processes.
+
+    The pages are transcoded concurrently (up to `workers` at a time per download) and yielded in order. They are given
+    to the processes through temporary files, and the results are read back within `downloads_memory`.
+
+    The processes are forked by `start`, before the bot starts any thread: forking a process with threads is unsafe,
+    and the other start methods would import the whole bot (`main.py`) again in each process.
+    """
+
+    def __init__(self, workers: int = 2, log_every: int = 100):
+        self.workers = workers
+        self.log_every = log_every
+        self._executor: ProcessPoolExecutor | None = None
+
+        self.chapters = 0
+        self.pages = 0
+        self.transcoded = 0
+        self.bytes_saved = 0
+        self.time_spent = 0.0
+
+    def start(self) -> None:
+        """Fork the processes. Until then, and if the pool breaks, the pages are sent as they are."""
+        self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("fork"))
+        # all the processes are forked on the first submission
+        self._executor.submit(int).result()
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def transcode(
+        self, downloads: AsyncGenerator[Download, None], name: str, max_size: int, quality: int
+    ) -> AsyncGenerator[Download, None]:
+        """Yield the downloads, with the pages bigger than `max_size` bytes re-encoded."""
+        stats = _ChapterStats()
+        pending: deque[asyncio.Task[Download]] = deque()
+        try:
+            async for download in downloads:
+                pending.append(asyncio.create_task(self._transcode(download, max_size, quality, stats)))
+                while len(pending) > self.workers:
+                    yield await pending.popleft()
+            while pending:
+                yield await pending.popleft()
+        finally:
+            # the pages not yielded because of an error or an interruption, waited so they are closed before returning
+            for task in pending:
+                task.cancel()
+            for result in await asyncio.gather(*pending, return_exceptions=True):
+                if isinstance(result, DownloadBytes):
+                    result.data.close()
+            await downloads.aclose()
+
+        self.chapters += 1
+        if stats.transcoded:
+            logger.info(
+                __(
+                    "Transcoded {}/{} pages of {} in {:.1f}s, {} KiB saved",
+                    stats.transcoded,
+                    stats.pages,
+                    name,
+                    stats.time_spent,
+                    stats.bytes_saved // 1024,
+                )
+            )
+        if self.chapters % self.log_every == 0:
+            logger.info(
+                __(
+                    "Transcoder: {} pages transcoded out of {}, {} MiB saved in {:.0f}s",
+                    self.transcoded,
+                    self.pages,
+                    self.bytes_saved // 1024**2,
+                    self.time_spent,
+                )
+            )
+
+    async def _transcode(self, download: Download, max_size: int, quality: int, stats: _ChapterStats) -> Download:
+        if not isinstance(download, DownloadBytes):
+            return download
+        stats.pages += 1
+        self.pages += 1
+
+        size = download.data.seek(0, io.SEEK_END)
+        download.data.seek(0)
+        if size <= max_size or self._executor is None:
+            return download
+
+        try:
+            return await self._recompress(download, size, max_size, quality, stats)
+        except BaseException:
+            # e.g. cancelled, the page is returned to nobody
+            download.data.close()
+            raise
+
+    async def _recompress(
+        self, download: DownloadBytes, size: int, max_size: int, quality: int, stats: _ChapterStats
+    ) -> DownloadBytes:
+        assert self._executor is not None  # nosec: B101
+        directory = await asyncio.to_thread(tempfile.mkdtemp, prefix="transcode-")
+        try:
+            source, destination = os.path.join(directory, "page"), os.path.join(directory, "page.jpg")
+            await asyncio.to_thread(self._copy, download.data, source)
+            try:
+                result_size, elapsed = await asyncio.get_running_loop().run_in_executor(
+                    self._executor, recompress, source, destination, max_size, quality
+                )
+            except BrokenProcessPool as e:
+                # not forked again, the bot has threads running now
+                logger.error("The transcoding pool is broken, the pages are sent as they are from now on", exc_info=e)
+                self.close()
+                return download
+            except (UnidentifiedImageError, Image.DecompressionBombError, OSError, ValueError) as e:
+                logger.debug(__("Can't transcode {}, sending it as is", download.filename), exc_info=e)
+                return download
+
+            stats.time_spent += elapsed
+            self.time_spent += elapsed
+            if result_size is None:
+                return download
+
+            buffer = SpooledBuffer(downloads_memory)
+            try:
+                with open(destination, "rb") as file:
+                    while chunk := await asyncio.to_thread(file.read, 1024**2):
+                        buffer.write(chunk)
+            except BaseException:
+                buffer.close()
+                raise
+            buffer.seek(0)
+        finally:
+            await asyncio.to_thread(shutil.rmtree, directory, True)
+
+        stats.transcoded += 1
+        stats.bytes_saved += size - result_size
+        self.transcoded += 1
+        self.bytes_saved += size - result_size
+        download.data.close()
+        return DownloadBytes(buffer, str(PurePath(download.filename).with_suffix(".jpg")))
+
+    @staticmethod
+    def _copy(data: IO[bytes], path: str) -> None:
+        with open(path, "wb") as file:
+            shutil.copyfileobj(data, file)
+        data.seek(0)
@@ -28,5 +28,20 @@ def chunker(iterable: Iterable[T], nb: int) -> Generator[Sequence[T], None, None
         yield tuple(chain((first_el,), chunk_it))
 
 
+def join_chunks(parts: Iterable[str], sep: str, limit: int) -> list[str]:
+    """Join `parts` with `sep` into strings of at most `limit` characters (a part longer than `limit` is cut)."""
+    chunks: list[str] = []
+    current = ""
+    for part in parts:
+        part = part[:limit]
+        if current and len(current) + len(sep) + len(part) > limit:
+            chunks.append(current)
+            current = ""
+        current = f"{current}{sep}{part}" if current else part
+    if current:
+        chunks.append(current)
+    return chunks
+
+
 def hash_id(_id: str) -> str:
     return hashlib.md5(_id.encode(), usedforsecurity=False).hexdigest()